@@ -0,0 +1,201 @@
+"""
+Drives a `Database` with a mix of operations at once, against a
+`benchmarks.fakestore` server with added latency running in another process,
+and reports the throughput and p50/p99 latency of each operation.
+
+    python -m benchmarks.bench_database --users 100000 --latency 50 --concurrency 64
+
+`--mix` weights the operations, eg `prefix=80,money=15,leaderboard=5,update_cache=0.05`.
+Writes are sent in the background, so the batches that carry them are timed
+as `flush`. Results can be saved with `--output` and later runs checked against
+them with `--compare`, which exits with an error if anything got slower.
+"""
+from argparse import ArgumentParser
+from asyncio import gather, get_event_loop
+from json import dump, dumps, load
+from os import remove
+from random import Random, randint, seed
+from subprocess import PIPE, Popen
+from sys import executable, exit
+from tempfile import mkstemp
+from time import perf_counter
+from types import SimpleNamespace
+
+from benchmarks.bench_ingest import generate, wait_for_port
+
+MIX = "prefix=80,money=15,leaderboard=5,update_cache=0.05"
+LEADERBOARD_GUILDS = 20 # Guilds the guild leaderboards are picked from
+LEADERBOARD_MEMBERS = 500
+
+
+def parse_mix(mix: str) -> dict:
+    weights = dict()
+    for part in mix.split(","):
+        op, _, weight = part.partition("=")
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation {op!r}, pick from {', '.join(OPERATIONS)}")
+        weights[op] = float(weight or 1)
+    return weights
+
+
+def percentile(timings: list, p: float) -> float:
+    """The nearest-rank percentile of sorted `timings`"""
+    return timings[min(len(timings) - 1, max(0, round(p / 100 * len(timings)) - 1))]
+
+
+def summarise(timings: list, elapsed: float) -> dict:
+    """Throughput in ops/s and latencies in milliseconds"""
+    timings = sorted(timings)
+    if not timings:
+        return dict(count=0)
+    return dict(
+        count=len(timings), ops_per_sec=round(len(timings) / elapsed, 1),
+        p50_ms=round(percentile(timings, 50) * 1000, 3), p99_ms=round(percentile(timings, 99) * 1000, 3),
+        max_ms=round(timings[-1] * 1000, 3),
+    )
+
+
+# Operations, each taking the database and a random number generator
+async def prefix(db, rng: Random, ids: SimpleNamespace):
+    await db.get_guild_prefix(rng.choice(ids.guilds))
+
+async def money(db, rng: Random, ids: SimpleNamespace):
+    await db.add_user_money(rng.choice(ids.users), rng.randint(1, 100))
+
+async def leaderboard(db, rng: Random, ids: SimpleNamespace):
+    await db.get_leaderboard(rng.choice(ids.leaderboard_guilds + [None]))
+
+async def update_cache(db, rng: Random, ids: SimpleNamespace):
+    await db.update_cache()
+
+OPERATIONS = dict(prefix=prefix, money=money, leaderboard=leaderboard, update_cache=update_cache)
+
+
+async def drive(url: str, users: int, guilds: int, operations: int, concurrency: int, weights: dict) -> dict:
+    from cogs.assets.database import Database
+
+    timings = {op: list() for op in [*weights, "flush"]}
+
+    class TimedDatabase(Database):
+        async def flush(self) -> bool:
+            sending, start = bool(self._pending), perf_counter()
+            result = await super().flush()
+            if sending:
+                timings["flush"].append(perf_counter() - start)
+            return result
+
+    db = await TimedDatabase.create(url)
+    seed(42)
+    userids = [10**17 + i for i in range(users)]
+    ids = SimpleNamespace(
+        users=userids, guilds=[10**17 + i for i in range(guilds)],
+        leaderboard_guilds=[
+            SimpleNamespace(id=i, members=[SimpleNamespace(id=userids[randint(0, users - 1)], bot=False) for _ in range(LEADERBOARD_MEMBERS)])
+            for i in range(LEADERBOARD_GUILDS)
+        ],
+    )
+
+    remaining = [operations]
+    async def worker(rng: Random):
+        choices, cumulative = list(weights), list()
+        for weight in weights.values():
+            cumulative.append(weight + (cumulative[-1] if cumulative else 0))
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            op = rng.choices(choices, cum_weights=cumulative)[0]
+            start = perf_counter()
+            await OPERATIONS[op](db, rng, ids)
+            timings[op].append(perf_counter() - start)
+
+    start = perf_counter()
+    await gather(*[worker(Random(i)) for i in range(concurrency)])
+    await db.flush() # Everything written has reached the store
+    elapsed = perf_counter() - start
+    await db.close()
+
+    results = {op: summarise(times, elapsed) for op, times in timings.items()}
+    return dict(seconds=round(elapsed, 3), ops_per_sec=round(operations / elapsed, 1), operations=results)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Every p50/p99 latency more than `tolerance` slower than in `baseline`,
+    and every throughput more than `tolerance` lower"""
+    regressions = list()
+    for op, result in results["operations"].items():
+        before = baseline["operations"].get(op)
+        if not before or not result.get("count") or not before.get("count"):
+            continue
+        for metric in ["p50_ms", "p99_ms"]:
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{op} {metric}: {before[metric]} -> {result[metric]}")
+        if result["ops_per_sec"] < before["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{op} ops_per_sec: {before['ops_per_sec']} -> {result['ops_per_sec']}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=50, help="Milliseconds the store adds to each request")
+    parser.add_argument("--operations", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=64, help="Operations running at once")
+    parser.add_argument("--mix", default=MIX, help="Weight of each operation")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    parser.add_argument("--compare", help="Results file to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Fraction slower that counts as a regression")
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    _, path = mkstemp(suffix=".json")
+    generate(path, args.users, args.guilds)
+    server = Popen(
+        [executable, "-m", "benchmarks.fakestore", "--port", str(args.port), "--data", path, "--latency", str(args.latency)],
+        stdout=PIPE, stderr=PIPE,
+    )
+    try:
+        wait_for_port(args.port)
+        results = get_event_loop().run_until_complete(drive(
+            f"http://127.0.0.1:{args.port}", args.users, args.guilds, args.operations, args.concurrency, weights,
+        ))
+    finally:
+        server.terminate()
+        remove(path)
+
+    results = dict(
+        users=args.users, guilds=args.guilds, latency_ms=args.latency, operations=args.operations,
+        concurrency=args.concurrency, mix=weights, results=results,
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            dump(results, f, indent=2)
+
+    if args.json:
+        print(dumps(results))
+    else:
+        r = results["results"]
+        print(
+            f"{args.operations:,} operations, {args.concurrency} at once, {args.users:,} users, {args.guilds:,} guilds, "
+            f"{args.latency:g}ms latency: {r['seconds']:.2f}s, {r['ops_per_sec']:,.0f} ops/s"
+        )
+        for op, stats in r["operations"].items():
+            if not stats["count"]:
+                continue
+            print(
+                f"{op:>13}: {stats['count']:>8,}  {stats['ops_per_sec']:>10,.1f} ops/s  "
+                f"p50 {stats['p50_ms']:>9.3f}ms  p99 {stats['p99_ms']:>9.3f}ms  max {stats['max_ms']:>9.3f}ms"
+            )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results["results"], load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Compares downloading the whole database into the cache by buffering and
+parsing the entire response (how `update_cache` used to work) against
+streaming it through `JSONStreamLoader`, reporting wall time and peak RSS.
+
+    python -m benchmarks.bench_ingest --users 1000000
+
+Each run happens in its own process, so one can't inflate the other's peak
+RSS, against a `benchmarks.fakestore` server running in another process.
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from json import dump, dumps, loads
+from os import remove
+from random import randint, seed
+from resource import RUSAGE_SELF, getrusage
+from socket import create_connection
+from subprocess import PIPE, Popen, run
+from sys import executable
+from tempfile import mkstemp
+from time import perf_counter, sleep
+
+MODES = ["buffered", "streaming"]
+
+
+def peak_rss() -> float:
+    """Peak resident memory of this process in MiB. `ru_maxrss` carries over from
+    the parent process on Linux, so `VmHWM` is used instead where it exists"""
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except (OSError, StopIteration):
+        return getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate(path: str, users: int, guilds: int):
+    """Writes a synthetic dump in the same shape as the real database"""
+    seed(42)
+    data = {
+        "users": {
+            str(10**17 + i): {"money": randint(0, 10**6), **({"bank": randint(0, 10**5)} if i % 3 == 0 else {})}
+            for i in range(users)
+        },
+        "guilds": {
+            str(10**17 + i): {
+                "prefix": "!", **({"minecraft": f"mc{i % 500}.example.com"} if i % 2 else {}),
+                **({"role": str(10**17 + i)} if i % 4 == 0 else {}),
+            }
+            for i in range(guilds)
+        },
+        "blacklist": {"guilds": {str(10**17 + i): "Spam" for i in range(guilds // 100)}},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        dump(data, f, separators=(",", ":"))
+
+
+async def ingest(url: str, mode: str) -> dict:
+    from aiohttp import ClientSession
+    from cogs.assets.database import Database
+
+    class MeasuredDatabase(Database):
+        def _rebuild_leaderboard(self):
+            """The leaderboard is built the same way by both, so measure before it too"""
+            self.parsed_rss = peak_rss()
+            super()._rebuild_leaderboard()
+
+    sess = ClientSession()
+    db = MeasuredDatabase(url, sess=sess)
+    before = peak_rss()
+    start = perf_counter()
+
+    if mode == "buffered":
+        db._cache.load((), await db.backend.fetch())
+        db._rebuild_indexes()
+    else:
+        await db.update_cache()
+
+    elapsed = perf_counter() - start
+    result = dict(
+        mode=mode, seconds=round(elapsed, 3), users=len(db._cache.users),
+        baseline_rss_mib=round(before, 1), parse_peak_rss_mib=round(db.parsed_rss, 1),
+        peak_rss_mib=round(peak_rss(), 1),
+    )
+    await sess.close()
+    return result
+
+
+def wait_for_port(port: int, timeout: float=120):
+    start = perf_counter()
+    while perf_counter() - start < timeout:
+        try: create_connection(("127.0.0.1", port), timeout=1).close()
+        except OSError: sleep(0.2)
+        else: return
+    raise TimeoutError(f"Fake store didn't start on port {port}")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--guilds", type=int, default=20000)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--mode", choices=MODES, help="Run a single mode against --url (used internally)")
+    parser.add_argument("--url")
+    args = parser.parse_args()
+
+    if args.mode:
+        return print(dumps(get_event_loop().run_until_complete(ingest(args.url, args.mode))))
+
+    _, path = mkstemp(suffix=".json")
+    generate(path, args.users, args.guilds)
+    server = Popen([executable, "-m", "benchmarks.fakestore", "--port", str(args.port), "--data", path], stdout=PIPE, stderr=PIPE)
+    try:
+        wait_for_port(args.port)
+        results = list()
+        for mode in MODES:
+            proc = run(
+                [executable, "-m", "benchmarks.bench_ingest", "--mode", mode, "--url", f"http://127.0.0.1:{args.port}"],
+                stdout=PIPE, check=True,
+            )
+            results.append(loads(proc.stdout.decode().strip().splitlines()[-1]))
+    finally:
+        server.terminate()
+        remove(path)
+
+    if args.json:
+        return print(dumps(dict(users=args.users, guilds=args.guilds, results=results)))
+    print(f"{args.users:,} users, {args.guilds:,} guilds")
+    for r in results:
+        print(
+            f"{r['mode']:>10}: {r['seconds']:>7.2f}s  "
+            f"peak RSS while parsing {r['parse_peak_rss_mib'] - r['baseline_rss_mib']:>7.1f} MiB, "
+            f"overall {r['peak_rss_mib'] - r['baseline_rss_mib']:>7.1f} MiB (above a {r['baseline_rss_mib']:.1f} MiB baseline)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Times guild prefix and wallet balance lookups: the old way of formatting a
+string path and `reduce`-ing it over nested dicts, the string paths that `get`
+still accepts, the async getters, and the typed accessors they now use.
+
+    python -m benchmarks.bench_lookup --lookups 1000000
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from functools import reduce
+from json import dumps
+from random import choice, randint, seed
+from time import perf_counter
+
+from aiohttp import ClientSession
+from cogs.assets.database import Database
+
+
+class NullBackend(object):
+    """Nothing is written anywhere, only the cache is used"""
+    revision = etag = None
+
+    async def batch(self, writes: list) -> list:
+        return [0] * len(writes)
+
+    async def close(self):
+        pass
+
+
+def generate(users: int, guilds: int) -> dict:
+    seed(42)
+    return {
+        "users": {str(10**17 + i): {"money": randint(1, 10**6)} for i in range(users)},
+        "guilds": {str(10**17 + i): {"prefix": "!"} for i in range(0, guilds, 2)},
+    }
+
+
+async def timed(fn, ids: list) -> float:
+    """Nanoseconds per call of the coroutine function `fn`"""
+    start = perf_counter()
+    for i in ids:
+        await fn(i)
+    return (perf_counter() - start) / len(ids) * 10**9
+
+
+def sync_timed(fn, ids: list) -> float:
+    """Nanoseconds per call of the plain function `fn`"""
+    start = perf_counter()
+    for i in ids:
+        fn(i)
+    return (perf_counter() - start) / len(ids) * 10**9
+
+
+async def run(users: int, guilds: int, lookups: int) -> dict:
+    data = generate(users, guilds)
+    sess = ClientSession()
+    db = Database("null://", sess=sess, backend=NullBackend())
+    db._apply("", data)
+
+    async def reduce_get(key: str, default=None):
+        """How `Database.get` used to look values up"""
+        return reduce(lambda d, k: d.get(k, default) if isinstance(d, dict) else default, key.split("/"), data)
+
+    guildids = [10**17 + choice(range(guilds)) for _ in range(lookups)]
+    userids = [10**17 + choice(range(users)) for _ in range(lookups)]
+    results = dict(
+        prefix=dict(
+            reduce_path=await timed(lambda g: reduce_get(f"guilds/{g}/prefix", None), guildids),
+            string_path=await timed(lambda g: db.get(f"guilds/{g}/prefix", None), guildids),
+            async_getter=await timed(db.get_guild_prefix, guildids),
+            accessor=sync_timed(db.guild_prefix, guildids),
+        ),
+        balance=dict(
+            reduce_path=await timed(lambda u: reduce_get(f"users/{u}/money", 0), userids),
+            string_path=await timed(lambda u: db.get(f"users/{u}/money", 0), userids),
+            async_getter=await timed(lambda u: db.get_user_money(u, human_readable=False), userids),
+            accessor=sync_timed(db.user_money, userids),
+        ),
+    )
+    await sess.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=1000000)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = get_event_loop().run_until_complete(run(args.users, args.guilds, args.lookups))
+    if args.json:
+        return print(dumps(dict(users=args.users, guilds=args.guilds, lookups=args.lookups, results=results)))
+
+    print(f"{args.lookups:,} lookups, {args.users:,} users, {args.guilds:,} guilds (half with a prefix)")
+    for name, timings in results.items():
+        baseline = timings["reduce_path"]
+        print(f"{name}:")
+        for method, ns in timings.items():
+            print(f"  {method:>12}: {ns:>7.0f} ns/lookup  {baseline / ns:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
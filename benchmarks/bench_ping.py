@@ -0,0 +1,74 @@
+"""
+Pings a `benchmarks.fakemc` server running in another process with
+`cogs.assets.mcping`, a number at a time, and reports how many pings a
+minute that comes to and the p50/p99 latency the pings measured.
+
+    python -m benchmarks.bench_ping --pings 10000 --concurrency 100 --delay 20 --edition java
+
+The first ping detects the server's edition, and the rest use that protocol.
+"""
+from argparse import ArgumentParser
+from asyncio import Semaphore, gather, get_event_loop
+from json import dumps
+from subprocess import PIPE, Popen
+from sys import executable
+from time import perf_counter, sleep
+
+from benchmarks.bench_database import summarise
+from benchmarks.bench_ingest import wait_for_port
+from cogs.assets.mcping import PingError, ping
+
+
+async def run(address: str, pings: int, concurrency: int) -> dict:
+    limit = Semaphore(concurrency)
+    latencies, failures = list(), [0]
+
+    async def one():
+        async with limit:
+            try: status = await ping(address)
+            except PingError:
+                failures[0] += 1
+            else: latencies.append(status.latency / 1000)
+
+    start = perf_counter()
+    await gather(*[one() for _ in range(pings)])
+    elapsed = perf_counter() - start
+    stats = summarise(latencies, elapsed)
+    return dict(seconds=round(elapsed, 3), pings_per_min=round(pings / elapsed * 60), failures=failures[0], latency=stats)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pings", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=100, help="Pings running at once")
+    parser.add_argument("--delay", type=float, default=20, help="Milliseconds the server waits before each answer")
+    parser.add_argument("--edition", choices=["java", "legacy", "bedrock"], default="java", help="The kind of server to run")
+    parser.add_argument("--port", type=int, default=25599)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    server = Popen(
+        [executable, "-m", "benchmarks.fakemc", "--edition", args.edition, "--port", str(args.port), "--delay", str(args.delay)],
+        stdout=PIPE, stderr=PIPE,
+    )
+    try:
+        if args.edition == "bedrock":
+            sleep(1) # Nothing to connect to over UDP to tell when it's up
+        else: wait_for_port(args.port)
+        results = get_event_loop().run_until_complete(run(f"127.0.0.1:{args.port}", args.pings, args.concurrency))
+    finally:
+        server.terminate()
+
+    if args.json:
+        return print(dumps(dict(pings=args.pings, concurrency=args.concurrency, delay_ms=args.delay, edition=args.edition, results=results)))
+    latency = results["latency"]
+    print(
+        f"{args.pings:,} pings, {args.concurrency} at once, {args.edition} server with {args.delay:g}ms delay: {results['seconds']:.2f}s, "
+        f"{results['pings_per_min']:,} pings/min, {results['failures']} failed"
+    )
+    if latency["count"]:
+        print(f"latency p50 {latency['p50_ms']:.1f}ms  p99 {latency['p99_ms']:.1f}ms  max {latency['max_ms']:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Pushes synthetic messages through the bot's `command_prefix` the same way
+`Bot.get_prefix` does, comparing the old `get_prefix` coroutine (a string path
+lookup and `when_mentioned_or` every message) against `PrefixResolver`.
+
+    python -m benchmarks.bench_prefix --messages 100000
+"""
+from argparse import ArgumentParser
+from asyncio import get_event_loop
+from functools import reduce
+from json import dumps
+from random import choice, random, seed
+from time import perf_counter
+from types import SimpleNamespace
+
+from discord.ext import commands
+from discord.utils import maybe_coroutine
+
+from cogs.assets.database import get_prefix, PrefixResolver
+
+
+def generate(guilds: int, messages: int, dms: float) -> tuple:
+    """A cache where every other guild has its own prefix, and messages from random guilds"""
+    seed(42)
+    cache = {"guilds": {str(10**17 + i): {"prefix": "?"} for i in range(0, guilds, 2)}}
+    guilds = [SimpleNamespace(id=10**17 + i) for i in range(guilds)]
+    msgs = [SimpleNamespace(guild=None if random() < dms else choice(guilds)) for _ in range(messages)]
+    return cache, msgs
+
+
+class OldDatabase(object):
+    """Just enough of the database to run the old `get_prefix`"""
+    ready = True
+
+    def __init__(self, cache: dict):
+        self._cache = cache
+
+    async def get(self, key: str, default=None):
+        return reduce(lambda d, k: d.get(k, default) if isinstance(d, dict) else default, key.split("/"), self._cache)
+
+    async def get_guild_prefix(self, guildid: int):
+        return await self.get(f"guilds/{guildid}/prefix", None)
+
+
+async def old_get_prefix(bot: commands.Bot, msg):
+    """How `get_prefix` used to work"""
+    prefixes = [bot.default_prefix]
+
+    if msg.guild:
+        if bot.is_ready() and bot.db.ready:
+            prfx = await bot.db.get_guild_prefix(msg.guild.id)
+            prefixes = [prfx] if prfx != None else prefixes
+    else: prefixes.append("")
+    return commands.when_mentioned_or(*prefixes)(bot, msg)
+
+
+async def timed(command_prefix, bot, msgs: list) -> float:
+    """Microseconds per message, going through what `Bot.get_prefix` does with the result"""
+    start = perf_counter()
+    for msg in msgs:
+        ret = await maybe_coroutine(command_prefix, bot, msg)
+        if not isinstance(ret, str):
+            ret = list(ret)
+    return (perf_counter() - start) / len(msgs) * 10**6
+
+
+async def run(guilds: int, messages: int, dms: float) -> dict:
+    cache, msgs = generate(guilds, messages, dms)
+    user = SimpleNamespace(id=10**17, mention=f"<@{10**17}>")
+
+    old = SimpleNamespace(user=user, default_prefix="m!", is_ready=lambda: True, db=OldDatabase(cache))
+    resolver = PrefixResolver()
+    resolver.configure(default="m!", userid=user.id)
+    for guildid, guild in cache["guilds"].items():
+        resolver.set(int(guildid), guild["prefix"])
+    new = SimpleNamespace(user=user, default_prefix="m!", db=SimpleNamespace(prefixes=resolver))
+
+    # Both have to agree before their timings mean anything
+    for msg in msgs[:1000]:
+        assert list(await old_get_prefix(old, msg)) == list(get_prefix(new, msg))
+    return dict(old=await timed(old_get_prefix, old, msgs), resolver=await timed(get_prefix, new, msgs))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--dms", type=float, default=0.05, help="Fraction of messages that are DMs")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = get_event_loop().run_until_complete(run(args.guilds, args.messages, args.dms))
+    if args.json:
+        return print(dumps(dict(messages=args.messages, guilds=args.guilds, results=results)))
+    print(f"{args.messages:,} messages from {args.guilds:,} guilds ({args.dms:.0%} DMs)")
+    for name, us in results.items():
+        print(f"{name:>9}: {us:>6.2f} us/message  {results['old'] / us:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
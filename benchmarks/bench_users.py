@@ -0,0 +1,119 @@
+"""
+Compares the memory used per user, and the time taken by whole table
+operations, between the nested dicts the users used to be cached as, a dict
+of `UserRecord`s, the columns of a `UserTable`, and everything `Database`
+keeps for its users, which is the columns and the `Leaderboard` over them.
+
+    python -m benchmarks.bench_users --users 1000000
+"""
+from argparse import ArgumentParser
+from gc import collect
+from heapq import nlargest
+from json import dumps, loads
+from random import randint, seed
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+from cogs.assets.database import Cache, Leaderboard, UserRecord, UserTable
+
+
+def generate(users: int) -> dict:
+    """The users in the shape the remote host stores them"""
+    seed(42)
+    return {
+        str(10**17 + i * 4194304 + randint(0, 4096)): {"money": randint(1, 10**6), **({"bank": randint(1, 10**5)} if i % 3 == 0 else {})}
+        for i in range(users)
+    }
+
+
+def nested(text: str) -> dict:
+    return loads(text)
+
+
+def records(text: str) -> dict:
+    return {int(userid): UserRecord.from_dict(user)[0] for userid, user in loads(text).items()}
+
+
+def columns(text: str) -> UserTable:
+    table = UserTable()
+    for userid, user in loads(text).items():
+        table[int(userid)] = UserRecord.from_dict(user)[0]
+    return table
+
+
+def database(text: str) -> Cache:
+    """Loaded the way `Database` loads them, with its leaderboard"""
+    cache = Cache()
+    cache.load(("users",), loads(text))
+    cache.leaderboard = Leaderboard(cache.users)
+    cache.leaderboard.load(cache.users)
+    return cache
+
+
+def measure(build, text: str) -> tuple:
+    """The bytes still allocated once `build` has parsed `text`, and what it made"""
+    collect()
+    start()
+    result = build(text)
+    collect()
+    size = get_traced_memory()[0]
+    stop()
+    return size, result
+
+
+def timed(fn, repeat: int=3) -> float:
+    """The best of `repeat` runs, in milliseconds"""
+    best = None
+    for _ in range(repeat):
+        begin = perf_counter()
+        fn()
+        elapsed = (perf_counter() - begin) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    text = dumps(generate(args.users))
+    results = dict()
+    for name, build in [("nested", nested), ("records", records), ("columns", columns), ("database", database)]:
+        size, users = measure(build, text)
+        if name == "database":
+            ops = dict(
+                top=lambda: users.leaderboard.top(10),
+                total=lambda: users.users.total(),
+                count=lambda: users.users.count("bank"),
+            )
+        elif name == "columns":
+            ops = dict(
+                top=lambda: users.top(10),
+                total=lambda: users.total(),
+                count=lambda: users.count("bank"),
+            )
+        else:
+            money = (lambda u: u.get("money", 0)) if name == "nested" else (lambda u: u.money or 0)
+            bank = (lambda u: u.get("bank", 0)) if name == "nested" else (lambda u: u.bank or 0)
+            ops = dict(
+                top=lambda: nlargest(10, users.items(), key=lambda item: money(item[1])),
+                total=lambda: sum(money(u) for u in users.values()),
+                count=lambda: sum(1 for u in users.values() if bank(u)),
+            )
+        results[name] = dict(bytes_per_user=round(size / args.users, 1), **{f"{op}_ms": round(timed(fn), 2) for op, fn in ops.items()})
+        del users, ops
+
+    if args.json:
+        return print(dumps(dict(users=args.users, results=results)))
+    print(f"{args.users:,} users")
+    for name, r in results.items():
+        print(
+            f"{name:>8}: {r['bytes_per_user']:>6.1f} bytes/user  top 10 {r['top_ms']:>7.1f}ms  "
+            f"total {r['total_ms']:>7.1f}ms  count {r['count_ms']:>7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
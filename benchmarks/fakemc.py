@@ -0,0 +1,211 @@
+"""
+Local stand-ins for Minecraft servers that only answer pings, for use in tests
+and benchmarks of `cogs.assets.mcping`: a Java Edition server, which answers
+legacy pings too like real ones since 1.7, a server from before 1.7, which only
+answers legacy pings, and a Bedrock Edition server.
+
+Run one on its own with `python -m benchmarks.fakemc --edition java --port 25565`
+"""
+from argparse import ArgumentParser
+from asyncio import DatagramProtocol, IncompleteReadError, get_event_loop, sleep, start_server
+from json import dumps
+from struct import pack
+
+from cogs.assets.mcping import RAKNET_MAGIC, PingError, pack_packet, pack_string, read_packet, unpack_varint
+
+STATUS = {
+    "version": {"name": "1.15.2", "protocol": 578},
+    "players": {"max": 100, "online": 5, "sample": [{"name": "Notch", "id": "069a79f4-44e9-4726-a5be-fca90e38aaf5"}]},
+    "description": {"text": "A §aMinecraft§r Server", "extra": [{"text": " for testing"}]},
+}
+LEGACY_STATUS = {"version": "1.6.4", "protocol": 78, "motd": "A §aLegacy§r Server", "online": 3, "max": 20}
+BEDROCK_STATUS = [
+    "MCPE", "A §aBedrock§r Server", "390", "1.14.60", "7", "30", "13253860892328930865", "Bedrock level", "Survival", "1",
+]
+
+
+def next_state(handshake: bytes) -> int:
+    """The state a handshake asks for, after the protocol version, address and port"""
+    _, offset = unpack_varint(handshake)
+    length, offset = unpack_varint(handshake, offset)
+    return unpack_varint(handshake, offset + length + 2)[0]
+
+
+def legacy_kick(text: str) -> bytes:
+    """A `0xFF` kick packet, which is how legacy pings are answered"""
+    data = text.encode("utf-16-be")
+    return pack("!BH", 0xFF, len(data) // 2) + data
+
+
+def legacy_status(status: dict, beta: bool=False) -> bytes:
+    if beta: # Before 1.4
+        return legacy_kick(f"{status['motd']}§{status['online']}§{status['max']}")
+    fields = ["§1", status["protocol"], status["version"], status["motd"], status["online"], status["max"]]
+    return legacy_kick("\x00".join(map(str, fields)))
+
+
+class FakeServer(object):
+    """Answers pings on `host`:`port` after waiting `delay` seconds, like a far away
+    server. If `port` is `0`, a free port is picked when it starts"""
+
+    def __init__(self, status=None, *, host: str="127.0.0.1", port: int=0, delay: float=0):
+        self.status = self.STATUS if status is None else status
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.pings = 0
+        self.server = None
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def handle(self, reader, writer):
+        try: await self.answer(reader, writer)
+        except (IncompleteReadError, PingError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def answer_legacy(self, writer, *, beta: bool=False):
+        self.pings += 1
+        if self.delay:
+            await sleep(self.delay)
+        writer.write(legacy_status(self.legacy, beta))
+        await writer.drain()
+
+
+class FakeMinecraftServer(FakeServer):
+    """A Java Edition server. With `pong` off, it closes the connection instead of
+    answering pings after the status, and with `legacy` off it ignores legacy pings.
+    `pong` can also be how many bytes of the ping's payload are echoed back"""
+    STATUS = STATUS
+
+    def __init__(self, status: dict=None, *, pong=True, legacy: bool=True, **kwargs):
+        super().__init__(status, **kwargs)
+        self.pong = 8 if pong is True else int(pong)
+        self.answers_legacy = legacy
+
+    @property
+    def legacy(self) -> dict:
+        """The status as a legacy ping gets it"""
+        version, players = self.status.get("version", {}), self.status.get("players", {})
+        return dict(
+            version=version.get("name", ""), protocol=version.get("protocol", 0), motd="A Minecraft Server",
+            online=players.get("online", 0), max=players.get("max", 0),
+        )
+
+    async def answer(self, reader, writer):
+        first = (await reader.readexactly(1))[0]
+        if first == 0xFE:
+            if self.answers_legacy:
+                await self.answer_legacy(writer)
+            return
+
+        # Otherwise that was the start of the handshake's length
+        length, shift = first & 0x7F, 7
+        while first & 0x80:
+            first = (await reader.readexactly(1))[0]
+            length |= (first & 0x7F) << shift
+            shift += 7
+        body = await reader.readexactly(length)
+        packetid, offset = unpack_varint(body)
+        if packetid != 0x00 or next_state(body[offset:]) != 1:
+            return # Not a handshake for the status state
+        await read_packet(reader) # Status request
+        self.pings += 1
+        if self.delay:
+            await sleep(self.delay)
+        writer.write(pack_packet(0x00, pack_string(dumps(self.status))))
+
+        packetid, body = await read_packet(reader)
+        if packetid == 0x01 and self.pong:
+            if self.delay:
+                await sleep(self.delay)
+            writer.write(pack_packet(0x01, body[:self.pong]))
+            await writer.drain()
+
+
+class FakeLegacyServer(FakeServer):
+    """A server from before 1.7, which kicks anything but a legacy ping. With
+    `beta` on, it answers in the format from before 1.4, without the version"""
+    STATUS = LEGACY_STATUS
+
+    def __init__(self, status: dict=None, *, beta: bool=False, **kwargs):
+        super().__init__(status, **kwargs)
+        self.beta = beta
+
+    @property
+    def legacy(self) -> dict:
+        return self.status
+
+    async def answer(self, reader, writer):
+        if (await reader.readexactly(1))[0] == 0xFE:
+            return await self.answer_legacy(writer, beta=self.beta)
+        writer.write(legacy_kick("Outdated client!"))
+        await writer.drain()
+
+
+class FakeBedrockServer(FakeServer, DatagramProtocol):
+    """A Bedrock Edition server, answering RakNet unconnected pings over UDP.
+    The first `drop` pings are ignored, like they were lost on the way"""
+    STATUS = BEDROCK_STATUS
+    GUID = 13253860892328930865 & (2 ** 63 - 1)
+
+    def __init__(self, status: list=None, *, drop: int=0, **kwargs):
+        super().__init__(status, **kwargs)
+        self.drop = drop
+        self.transport = None
+
+    async def start(self):
+        self.transport, _ = await get_event_loop().create_datagram_endpoint(lambda: self, local_addr=(self.host, self.port))
+        self.port = self.transport.get_extra_info("sockname")[1]
+        return self
+
+    async def stop(self):
+        self.transport.close()
+
+    def datagram_received(self, data: bytes, addr):
+        if len(data) < 33 or data[0] != 0x01 or data[9:25] != RAKNET_MAGIC:
+            return
+        if self.drop:
+            self.drop -= 1
+            return
+        self.pings += 1
+        status = ";".join(map(str, self.status)).encode("utf-8") + b";"
+        pong = data[1:9] + pack("!q", self.GUID) + RAKNET_MAGIC + pack("!H", len(status)) + status
+        if self.delay:
+            get_event_loop().call_later(self.delay, self.transport.sendto, b"\x1c" + pong, addr)
+        else: self.transport.sendto(b"\x1c" + pong, addr)
+
+
+SERVERS = dict(java=FakeMinecraftServer, legacy=FakeLegacyServer, bedrock=FakeBedrockServer)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--edition", choices=SERVERS, default="java")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=25565)
+    parser.add_argument("--delay", type=float, default=0, help="Milliseconds to wait before each answer")
+    args = parser.parse_args()
+
+    loop = get_event_loop()
+    server = loop.run_until_complete(SERVERS[args.edition](host=args.host, port=args.port, delay=args.delay / 1000).start())
+    print(f"Answering {args.edition} pings on {server.address}")
+    loop.run_forever()
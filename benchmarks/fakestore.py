@@ -0,0 +1,241 @@
+"""
+A local stand-in for the remote JSON store that `cogs.assets.database.RESTBackend`
+talks to, for use in tests and benchmarks. It keeps everything in memory.
+
+Run it on its own with `python -m benchmarks.fakestore --port 8765`
+and point `DATABASE_URL` at `http://localhost:8765`
+"""
+from argparse import ArgumentParser
+from asyncio import Queue, TimeoutError, sleep, wait_for
+from collections import deque
+from copy import deepcopy
+from json import dumps, load
+
+from aiohttp import web
+
+
+class FakeStore(object):
+    """An in-memory JSON store, served over HTTP on `host`:`port`.
+    If `port` is `0`, a free port is picked when it starts. Every request
+    but event streams waits `latency` seconds first, like a far away host"""
+    KEEPALIVE = 15 # Seconds between comments sent to quiet event streams
+
+    def __init__(self, data: dict=None, *, host: str="127.0.0.1", port: int=0, history: int=10000, latency: float=0):
+        self.data = data or dict()
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+
+        # Every write bumps the revision, and the last `history` are kept for `?since=`
+        self.revision = 0
+        self.history = deque(maxlen=history) # [(revision, key, value)]
+        self.listeners = set() # A queue of events for each open event stream
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/{key:.*}", self.handle)
+        self.app.on_shutdown.append(self.close_streams)
+        self.runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    # Data functions
+    def lookup(self, path: list):
+        data = self.data
+        for k in path:
+            if not isinstance(data, dict) or k not in data:
+                return None
+            data = data[k]
+        return data
+
+    def set(self, path: list, value):
+        if not path:
+            self.data = value if isinstance(value, dict) else dict()
+            return
+        if value is None:
+            return self.delete(path)
+
+        data = self.data
+        for k in path[:-1]:
+            if not isinstance(data.get(k), dict):
+                data[k] = dict()
+            data = data[k]
+        data[path[-1]] = value
+
+    def delete(self, path: list):
+        if not path:
+            self.data = dict()
+            return
+
+        parents = [self.data]
+        for k in path[:-1]:
+            if not isinstance(parents[-1].get(k), dict):
+                return
+            parents.append(parents[-1][k])
+        parents[-1].pop(path[-1], None)
+
+        # Empty objects are removed, like the real thing
+        for parent, k in reversed(list(zip(parents[:-1], path[:-1]))):
+            if parent[k]: break
+            del parent[k]
+
+    def increment(self, path: list, delta: int, minimum: int=None) -> int:
+        value = self.lookup(path) or 0
+        if type(value) is not int or type(delta) is not int:
+            raise web.HTTPBadRequest(text=f"Can't add {delta!r} to {value!r}")
+        value += delta
+        value = value if minimum is None else max(value, minimum)
+        self.set(path, value or None)
+        return value
+
+    def record(self, path: list):
+        """Remembers the value `path` was just written to"""
+        self.revision += 1
+        self.history.append((self.revision, "/".join(path), self.lookup(path)))
+        for queue in self.listeners:
+            queue.put_nowait(self.event(*self.history[-1]))
+
+    def event(self, revision: int, key: str, value) -> bytes:
+        return f"id: {revision}\ndata: {dumps(dict(key=key, value=value))}\n\n".encode()
+
+    def changes(self, since: int) -> list:
+        """The writes since `since`, keeping only the last write to each key,
+        or `None` if they aren't all in the history any more"""
+        if since < self.revision - len(self.history):
+            return None
+        latest = {key: (revision, value) for revision, key, value in self.history if revision > since}
+        return [[key, value] for key, (revision, value) in sorted(latest.items(), key=lambda i: i[1][0])]
+
+    def batch(self, writes: list) -> list:
+        """Applies every write in one go, returning the new values. If any of them
+        can't be applied, none of them are, and the error saying why is raised"""
+        results, undo = list(), list() # [(path, value before)]
+        try:
+            for write in writes:
+                path = [k for k in write["key"].split("/") if k]
+                undo.append((path, deepcopy(self.lookup(path))))
+                if write["op"] == "set":
+                    self.set(path, write["value"])
+                    results.append(write["value"])
+                elif write["op"] in ["inc", "transfer"]:
+                    minimum = write.get("minimum")
+                    value = self.increment(path, write["value"], minimum if write["op"] == "inc" else None)
+                    if write["op"] == "transfer" and minimum is not None and value < minimum:
+                        raise web.HTTPConflict(text=f"{write['key']} would go below {minimum} ({value})")
+                    results.append(value)
+                else: raise web.HTTPBadRequest(text=f"Unknown op {write['op']!r}")
+        except web.HTTPException:
+            for path, value in reversed(undo):
+                self.set(path, value)
+            raise
+
+        for path, _ in undo:
+            self.record(path)
+        return results
+
+    # Request handlers
+    async def handle(self, request: web.Request):
+        self.requests += 1
+        path = [k for k in request.match_info["key"].split("/") if k]
+
+        if request.method == "GET" and "events" in request.query:
+            return await self.stream_events(request)
+        if self.latency:
+            await sleep(self.latency)
+        if request.method == "GET":
+            if "since" in request.query:
+                changes = self.changes(int(request.query["since"]))
+                if changes is None:
+                    raise web.HTTPGone()
+                return web.json_response(dict(result=dict(changes=changes), revision=self.revision, ok=True))
+
+            # Downloads can be skipped if nothing changed, and are compressed if they aren't
+            etag = f'"{self.revision}"'
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            resp = web.json_response(dict(result=self.lookup(path), revision=self.revision, ok=True), headers={"ETag": etag})
+            resp.enable_compression()
+            return resp
+
+        if request.method == "POST":
+            self.set(path, await request.json())
+        elif request.method == "DELETE":
+            self.delete(path)
+        elif request.method == "PATCH":
+            body = await request.json()
+            if "batch" in body:
+                return web.json_response(dict(result=self.batch(body["batch"]), revision=self.revision, ok=True))
+            value = self.increment(path, body["increment"], body.get("minimum"))
+            self.record(path)
+            return web.json_response(dict(result=value, revision=self.revision, ok=True))
+        else:
+            raise web.HTTPMethodNotAllowed(request.method, ["GET", "POST", "DELETE", "PATCH"])
+        self.record(path)
+        return web.json_response(dict(revision=self.revision, ok=True))
+
+    async def stream_events(self, request: web.Request):
+        """Sends each write as a server-sent event as it's made, starting
+        after the revision in `Last-Event-ID` if the client is resuming"""
+        backlog = list()
+        if "Last-Event-ID" in request.headers:
+            since = int(request.headers["Last-Event-ID"])
+            if since < self.revision - len(self.history):
+                raise web.HTTPGone()
+            backlog = [self.event(*entry) for entry in self.history if entry[0] > since]
+
+        queue = Queue()
+        self.listeners.add(queue) # Nothing can be written between this and the backlog
+        try:
+            resp = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+            await resp.prepare(request)
+            for event in backlog:
+                await resp.write(event)
+            while True:
+                try: event = await wait_for(queue.get(), self.KEEPALIVE)
+                except TimeoutError:
+                    event = b": keepalive\n\n"
+                if event is None: # Shutting down
+                    return resp
+                await resp.write(event)
+        finally:
+            self.listeners.discard(queue)
+
+    async def close_streams(self, app: web.Application):
+        for queue in self.listeners:
+            queue.put_nowait(None)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--data", help="JSON file to load the store from")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to each request")
+    args = parser.parse_args()
+
+    data = None
+    if args.data:
+        with open(args.data, encoding="utf-8") as f:
+            data = load(f)
+
+    store = FakeStore(data, host=args.host, port=args.port, latency=args.latency / 1000)
+    web.run_app(store.app, host=args.host, port=args.port)
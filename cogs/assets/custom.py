@@ -32,16 +32,21 @@ class CustomBot(commands.AutoShardedBot):
         # Initialize essentials
         super().__init__(*args, **kwargs)
 
-        # Add an instance of our database
-        self.db = database.Database(environ.get("DATABASE_URL"))
+        # Add an instance of our database, sharing the bot's connections
+        self.session = ClientSession(loop=self.loop)  # HTTP request manager
+        self.db = database.Database(
+            environ.get("DATABASE_URL"), sess=self.session,
+            snapshot=environ.get("DATABASE_SNAPSHOT"), # eg `./moopitymoop.snapshot`
+        )
+        self.db.subscribe(lambda event: self.dispatch(event.name, event)) # eg `on_guild_setting_changed`
 
         # A buncha variables I'll be using later on
         self.env = environ  # Enable env to be used bot-wide
         self.development = True if self.env.get("DEVELOPMENT", "False").upper() == "TRUE" else False
         self.guild_invite_url = "https://discord.gg/AJj45Sj"  # Support guild invite url
-        self.session = ClientSession(loop=self.loop)  # HTTP request manager
         self.startup_time = dt.utcnow()  # Store bot startup time
         self.default_prefix = "m!" if not self.development else "." # Yayeet
+        self.db.prefixes.configure(default=self.default_prefix)
         self.delete_data_on_remove = True if self.env.get("DELETE_DATA_ON_REMOVE", "False").upper() == "TRUE" else False
         self.website_url = "https://www.moopitymoop.tk" if not self.development else "http://localhost:8080"
         self.oauth_callback = f"{self.website_url}/login"
@@ -94,6 +99,9 @@ class CustomBot(commands.AutoShardedBot):
         super().run(self.env["BOT_TOKEN"], *args, **kwargs)
 
     async def logout(self, *args, **kwargs):
+        self.logger.debug("Flushing pending database writes")
+        await self.db.close()
+
         self.logger.debug("Closing custom aiohttp ClientSession")
         await self.session.close()
         
@@ -1,21 +1,1218 @@
-from asyncio import get_event_loop
-from os import getenv
-from functools import reduce
+from array import array
+from asyncio import Lock, ensure_future, get_event_loop, sleep
+from bisect import bisect_right
+from codecs import getincrementaldecoder
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
+from os import getenv, replace
+from functools import partial, reduce
+from inspect import isawaitable
+from heapq import nlargest, nsmallest
+from itertools import count, islice
+from logging import getLogger
 
-from aiohttp import ClientSession
+from aiohttp import BaseConnector, ClientSession, ClientTimeout
 from discord import Message
 from discord.ext import commands
-from json import dumps
+from json import JSONDecodeError, JSONDecoder, dumps, loads
+from re import compile
+from sqlite3 import connect as sqlite_connect
+from sys import intern
+from time import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+NOT_MODIFIED = object() # Returned by backends when nothing has changed since the last download
+
+
+class WriteRejected(Exception):
+    """Raised by backends when the remote host won't ever take a write, eg because
+    it's invalid, or a transfer would take a balance below its minimum, so there's
+    no point retrying it"""
+
+
+# Changes published by `Database`, which `CustomBot` dispatches as `on_<name>` events
+class GuildSettingChanged(NamedTuple):
+    """A guild's `prefix`, `minecraft` server or Minecraft `role` changed,
+    `None` meaning it isn't set"""
+    guildid: int
+    setting: str
+    old: Any
+    new: Any
+    name = "guild_setting_changed"
+
+class GuildDeleted(NamedTuple):
+    """A guild no longer has anything stored, either because it was deleted or its
+    last setting was cleared. A `GuildSettingChanged` is still published for each setting"""
+    guildid: int
+    name = "guild_deleted"
+
+class BalanceChanged(NamedTuple):
+    """A user's `money` or `bank` balance changed"""
+    userid: int
+    account: str
+    old: int
+    new: int
+    name = "balance_changed"
+
+class CacheReloaded(NamedTuple):
+    """The whole cache was replaced at once, eg by `update_cache`. Guild changes are still
+    published one by one, but there are too many users, so balances may have changed without a
+    `BalanceChanged`"""
+    name = "cache_reloaded"
+
+
+class JSONStreamLoader(object):
+    """
+        Parses a JSON document bit by bit as it arrives. Objects less than `depth`
+        levels deep are walked into, and every value at that depth (or anything
+        that isn't an object above it) is decoded on its own and passed straight to
+        `callback(path, value)`, where `path` is a tuple of the keys leading to it.
+        The whole document is never held in memory at once, only the current value
+    """
+    WHITESPACE = compile(r"[ \t\n\r]*")
+    RECORD = compile(r',[ \t\n\r]*"([^"]*)"[ \t\n\r]*:[ \t\n\r]*(?=[^ \t\n\r])')
+
+    def __init__(self, callback, depth: int):
+        self.callback = callback
+        self.depth = depth
+        self.done = False
+
+        # Records are decoded separately, so the usual sharing of repeated keys is done here
+        self._decoder = JSONDecoder(object_pairs_hook=lambda pairs: {intern(k): v for k, v in pairs})
+        self._text = getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._path = list() # Keys of the objects we're inside
+        self._state = "value" # What's expected next: value, key, colon, or comma
+
+    def feed(self, data: bytes):
+        self._buf = self._buf[self._pos:] + self._text.decode(data)
+        self._pos = 0
+        self._parse(final=False)
+
+    def close(self):
+        """Parses whatever is left, raising `ValueError` if the document isn't finished"""
+        self._buf = self._buf[self._pos:] + self._text.decode(b"", final=True)
+        self._pos = 0
+        self._parse(final=True)
+        if not self.done:
+            raise ValueError("JSON document ended early")
+
+    def _parse(self, final: bool):
+        buf = self._buf
+        while not self.done:
+            pos = self.WHITESPACE.match(buf, self._pos).end()
+            if pos == len(buf):
+                return # Wait for more
+            char = buf[pos]
+
+            if self._state == "value":
+                if char == "{" and len(self._path) < self.depth:
+                    self._path.append(None)
+                    self._state = "key"
+                    self._pos = pos + 1
+                    continue
+                try: value, end = self._decoder.raw_decode(buf, pos)
+                except JSONDecodeError:
+                    if final: raise
+                    return # The value isn't all here yet
+                if not final and self._cut_off(buf, pos, end):
+                    return
+                self.callback(tuple(self._path), value)
+                self._pos = end
+                self._end_value()
+            elif self._state == "key":
+                if char == "}":
+                    self._path.pop()
+                    self._pos = pos + 1
+                    self._end_value()
+                    continue
+                if char != '"':
+                    raise ValueError(f"Expected a key at {pos}, got {char!r}")
+                try: key, end = self._decoder.raw_decode(buf, pos)
+                except JSONDecodeError:
+                    if final: raise
+                    return
+                self._path[-1] = key
+                self._state, self._pos = "colon", end
+            elif self._state == "colon":
+                if char != ":":
+                    raise ValueError(f"Expected ':' at {pos}, got {char!r}")
+                self._state, self._pos = "value", pos + 1
+            else:
+                # Most of the document is records one after the other, so they
+                # get a quicker path that reads the comma, key and value at once
+                record = self.RECORD.match(buf, pos) if len(self._path) == self.depth else None
+                if record and "\\" not in record.group(1):
+                    try: value, end = self._decoder.raw_decode(buf, record.end())
+                    except JSONDecodeError:
+                        if final: raise
+                        return
+                    if not final and self._cut_off(buf, record.end(), end):
+                        return
+                    self._path[-1] = record.group(1)
+                    self.callback(tuple(self._path), value)
+                    self._pos = end
+                elif char == ",":
+                    self._state, self._pos = "key", pos + 1
+                elif char == "}":
+                    self._path.pop()
+                    self._pos = pos + 1
+                    self._end_value()
+                else:
+                    raise ValueError(f"Expected ',' or '}}' at {pos}, got {char!r}")
+
+    @staticmethod
+    def _cut_off(buf: str, start: int, end: int) -> bool:
+        """Whether the value decoded from `buf[start:end]` could be the start of a longer
+        one, which is the case for numbers that run up to the end of the buffer, or up to
+        a character that could continue them, eg `1.` or `1.5e` decode as `1` and `1.5`"""
+        return buf[start] not in "{[\"" and (end == len(buf) or buf[end] in ".eE+-")
+
+    def _end_value(self):
+        self._state = "comma"
+        self.done = not self._path
+
+
+class Leaderboard(object):
+    """
+        Keeps the users with money sorted by their wallet balance, updated as balances
+        change. Only their ids are kept, in blocks of up to `2 * BLOCK` in an `array`
+        each, and balances are read from the `UserTable` when comparing them, so it takes
+        8 bytes a user on top of the table. Finding the top `n` users is `O(n)` and
+        finding a user's rank or moving them is `O(log u + u / BLOCK)`
+    """
+    BLOCK = 1024
+
+    def __init__(self, users: "UserTable"):
+        self._users = users
+        self._blocks = list() # [array of userids], by (-money, userid)
+        self._heads = list() # [(-money, userid)] of the first user in each block
+        self._len = 0
+        self._members = dict() # {guildid: {userid}}
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, userid: int) -> bool:
+        return bool(self._users.value(userid, "money"))
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def update(self, userid: int, old: int):
+        """Moves a user from where their `old` balance put them to
+        where their balance in the table does, removing them if it's 0"""
+        money = self._users.value(userid, "money")
+        if old:
+            b, i = self._find(userid, old)
+            block = self._blocks[b]
+            del block[i]
+            if not block:
+                del self._blocks[b], self._heads[b]
+            elif i == 0:
+                self._heads[b] = self._key(block[0])
+            self._len -= 1
+        if money and not self._blocks:
+            self._blocks.append(array("q", [userid]))
+            self._heads.append((-money, userid))
+            self._len += 1
+        elif money:
+            b, i = self._find(userid, money)
+            block = self._blocks[b]
+            block.insert(i, userid)
+            if i == 0:
+                self._heads[b] = (-money, userid)
+            if len(block) > 2 * self.BLOCK:
+                self._blocks[b:b + 1] = [block[:self.BLOCK], block[self.BLOCK:]]
+                self._heads.insert(b + 1, self._key(block[self.BLOCK]))
+            self._len += 1
+
+    def clear(self):
+        self._blocks.clear()
+        self._heads.clear()
+        self._len = 0
+
+    def load(self, users: "UserTable"):
+        """Sorts everyone in `users` at once, which is quicker than adding them one by one,
+        and keeps them up to date with it from then on"""
+        self._users = users
+        ranked = sorted((-money, userid) for userid, money in zip(users.ids, users.money) if money)
+        self._heads = ranked[::self.BLOCK]
+        ranked = array("q", (userid for _, userid in ranked))
+        self._blocks = [ranked[start:start + self.BLOCK] for start in range(0, len(ranked), self.BLOCK)]
+        self._len = len(ranked)
+
+    def top(self, n: int=None, *, guildid: int=None) -> Dict[int, int]:
+        """The richest `n` users (or everyone) as `{userid: money}`, richest first.
+        If `guildid` is specified, only members of that guild are counted"""
+        value = self._users.value
+        if guildid is None:
+            return {userid: value(userid, "money") for userid in islice(self, n)}
+
+        # Small guilds are quicker to sort on their own than to find in everyone
+        members = self._members.get(guildid, set())
+        if n is None or len(members) * 4 < self._len:
+            balances = ((-money, u) for money, u in ((value(u, "money"), u) for u in members) if money)
+            ranked = sorted(balances) if n is None else nsmallest(n, balances)
+            return {userid: -money for money, userid in ranked}
+        ranked = (u for u in self if u in members)
+        return {userid: value(userid, "money") for userid in islice(ranked, n)}
+
+    def rank(self, userid: int) -> Optional[int]:
+        money = self._users.value(userid, "money")
+        if not money:
+            return None
+        b, i = self._find(userid, money)
+        return sum(map(len, self._blocks[:b])) + i + 1
+
+    def _key(self, userid: int) -> Tuple[int, int]:
+        return -self._users.value(userid, "money"), userid
+
+    def _find(self, userid: int, money: int) -> Tuple[int, int]:
+        """The block that `userid` is in, or would go in, with `money` in their wallet,
+        and their position in it. Everyone else is compared by their balance in the table,
+        but not `userid`, since it may have already changed when they're being moved"""
+        target = (-money, userid)
+        b = max(bisect_right(self._heads, target) - 1, 0)
+        block, value = self._blocks[b], self._users.value
+        lo, hi = 0, len(block)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = block[mid]
+            if (-money if other == userid else -value(other, "money"), other) < target: lo = mid + 1
+            else: hi = mid
+        return b, lo
+
+    # Guild members, of which only the ones with money are kept
+    def has_guild(self, guildid: int) -> bool:
+        return guildid in self._members
+
+    def set_members(self, guildid: int, userids):
+        value = self._users.value
+        self._members[guildid] = {userid for userid in userids if value(userid, "money")}
+
+    def add_member(self, guildid: int, userid: int):
+        """Adds a member to a guild whose members are already known, if they have money"""
+        if guildid in self._members and self._users.value(userid, "money"):
+            self._members[guildid].add(userid)
+
+    def remove_member(self, guildid: int, userid: int):
+        self._members.get(guildid, set()).discard(userid)
+
+    def remove_guild(self, guildid: int):
+        self._members.pop(guildid, None)
+
+
+class PrefixResolver(object):
+    """
+        Works out which prefixes a message can use, for the bot's `command_prefix`.
+        The whole tuple of prefixes for each guild with its own prefix is worked out
+        ahead of time, so resolving a message is a single dict lookup
+    """
+
+    def __init__(self, default: str="m!"):
+        self._default = default
+        self._mentions = tuple()
+        self._prefixes = dict() # {guildid: prefix}
+        self._rebuild()
+
+    def __call__(self, bot: commands.Bot, msg: Message) -> Tuple[str, ...]:
+        if msg.guild is None:
+            return self._direct
+        return self._table.get(msg.guild.id, self._fallback)
+
+    def set(self, guildid: int, prefix: Optional[str]):
+        """Changes a guild's own prefix, going back to the default if it's `None`"""
+        if prefix:
+            self._prefixes[guildid] = prefix
+            self._table[guildid] = self._mentions + (prefix,)
+        else:
+            self._prefixes.pop(guildid, None)
+            self._table.pop(guildid, None)
+
+    def __iter__(self):
+        """The ids of the guilds with their own prefix"""
+        return iter(self._prefixes)
+
+    def get(self, guildid: int) -> Optional[str]:
+        """A guild's own prefix, if it has one"""
+        return self._prefixes.get(guildid)
+
+    def configure(self, *, default: str=None, userid: int=None):
+        """Sets the default prefix, or the bot's user id the mention prefixes are made
+        from. These only change on startup, so every guild's prefixes are worked out again"""
+        if default is not None:
+            self._default = default
+        if userid is not None:
+            self._mentions = (f"<@{userid}> ", f"<@!{userid}> ")
+        self._rebuild()
+
+    def _rebuild(self):
+        self._fallback = self._mentions + (self._default,)
+        self._direct = self._fallback + ("",) # Anything works in DMs
+        self._table = {guildid: self._mentions + (prefix,) for guildid, prefix in self._prefixes.items()}
+
+
+class RESTBackend(object):
+    """
+        The remote JSON store the bot keeps its data in. Keys are
+        paths under the base url, in the format `one/two`, etc.
+
+        - `GET` returns the value as `{"result": value}`, with an `ETag` if the
+          store supports `If-None-Match`, and gzipped if it supports that
+        - `POST` sets the value to the request body
+        - `DELETE` removes the value
+        - `PATCH` with `{"increment": delta, "minimum": floor}` adds `delta` to
+          the number stored there (missing counts as `0`), never going below
+          `floor`, and returns the new value as `{"result": value}`
+        - `GET` on the base url with `?since=revision` returns the writes made since
+          then as `{"result": {"changes": [[key, value], ...]}}`, or `410` if it
+          doesn't remember back that far. Stores that support this also include
+          their current `"revision"` next to `"result"` when downloading everything
+        - `PATCH` on the base url with `{"batch": [write, ...]}` applies several
+          writes atomically, in order. Each write is `{"key", "op", "value", "minimum"}`
+          where `op` is `set` (a `null` value deletes), `inc`, or `transfer`, which
+          adds like `inc` does, but instead of going below `minimum`, nothing in
+          the batch is applied and the store answers `409`. Returns the new
+          value of each write as `{"result": [value, ...]}`
+        - Writes the store won't ever take get a `4xx` status, other than `408` or `429`.
+          Stores without batches answer those with `404`, `405` or `501` instead
+        - `GET` on the base url with `?events` streams every write as it's made, as
+          server-sent events with the revision as the `id` and `{"key", "value"}` as
+          the `data`. A `Last-Event-ID` header resumes after that revision, or gets
+          `410` like `?since` does. Quiet streams are kept alive with comments
+    """
+    CHUNK_SIZE = 2 ** 16 # Bytes read at a time when streaming downloads
+    RETRYABLE = {408, 429} # Client error statuses that are worth trying again
+    UNSUPPORTED = {404, 405, 501} # Statuses meaning the store doesn't take batches at all
+    LISTEN_TIMEOUT = 60 # Seconds an event stream can go without sending anything before it's given up on
+
+    def __init__(self, url: str, sess: ClientSession=None, *, connector: BaseConnector=None, timeout: int=5):
+        """Without a `sess`, one is made the first time a request is sent, using
+        `connector`'s connection pool if it's given, and closed with the backend"""
+        self.url = url
+        self.timeout = timeout
+        self.revision = None # The store's revision as of the last download, if it keeps one
+        self.etag = None
+        self.connector = connector
+        self._sess = sess
+        self._owns_session = sess is None
+
+    @property
+    def sess(self) -> ClientSession:
+        if self._sess is None:
+            self._sess = ClientSession(connector=self.connector, connector_owner=self.connector is None)
+        return self._sess
+
+    async def fetch(self, *, if_changed: bool=False) -> dict:
+        """Downloads everything in the store. If `if_changed` is `True` and the store
+        hasn't changed since the last download, returns `NOT_MODIFIED` instead"""
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if if_changed and self.etag:
+            headers["If-None-Match"] = self.etag
+
+        async with self.sess.get(self.url, headers=headers) as resp:
+            if resp.status == 304:
+                return NOT_MODIFIED
+            resp.raise_for_status()
+            body = await resp.json()
+            self.etag = resp.headers.get("ETag")
+        self.revision = body.get("revision")
+        return body["result"]
+
+    async def stream(self, callback, *, if_changed: bool=False):
+        """
+            Like `fetch`, but passes each record to `callback(path, value)` as soon as
+            it has been downloaded and parsed, eg `(("users", "1234"), {"money": 5})`,
+            so the whole download never has to be held in memory
+        """
+        headers = {"Accept-Encoding": "gzip, deflate"}
+        if if_changed and self.etag:
+            headers["If-None-Match"] = self.etag
+
+        revision = list()
+        def route(path: tuple, value):
+            if path[:1] == ("result",):
+                callback(path[1:], value)
+            elif path == ("revision",):
+                revision.append(value)
+
+        async with self.sess.get(self.url, headers=headers) as resp:
+            if resp.status == 304:
+                return NOT_MODIFIED
+            resp.raise_for_status()
+
+            loader = JSONStreamLoader(route, depth=3) # {"result": {"users": {"1234": ...}}}
+            async for chunk in resp.content.iter_chunked(self.CHUNK_SIZE):
+                loader.feed(chunk)
+            loader.close()
+            self.etag = resp.headers.get("ETag")
+        self.revision = revision[0] if revision else None
+
+    async def changes(self, since: int) -> Optional[list]:
+        """Every `[key, value]` write since revision `since`, oldest first,
+        or `None` if the store doesn't remember back that far"""
+        async with self.sess.get(self.url, params={"since": since}, timeout=self.timeout) as resp:
+            if resp.status == 410:
+                return None
+            resp.raise_for_status()
+            body = await resp.json()
+        self.revision = body["revision"]
+        return body["result"]["changes"]
+
+    async def listen(self, callback) -> Optional[bool]:
+        """
+            Follows the store's writes as they're made, passing each one after `revision`
+            to `callback(key, value)` and moving `revision` along. Returns `True` once
+            the store closes the stream, or `False` straight away if it doesn't remember
+            back to `revision`, in which case everything needs downloading again, or
+            `None` if it doesn't send events at all
+        """
+        headers = {"Accept": "text/event-stream"}
+        if self.revision is not None:
+            headers["Last-Event-ID"] = str(self.revision)
+        timeout = ClientTimeout(total=None, sock_read=self.LISTEN_TIMEOUT)
+
+        async with self.sess.get(self.url, params={"events": ""}, headers=headers, timeout=timeout) as resp:
+            if resp.status == 410:
+                return False
+            resp.raise_for_status()
+            if resp.content_type != "text/event-stream":
+                return None # Probably the whole database, which isn't worth reading
+
+            eventid, data = None, list()
+            async for line in resp.content:
+                line = line.decode().rstrip("\r\n")
+                if not line: # The end of an event
+                    if data:
+                        event = loads("\n".join(data))
+                        callback(event["key"], event["value"])
+                        if eventid is not None:
+                            self.revision = int(eventid)
+                    eventid, data = None, list()
+                    continue
+
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "id":
+                    eventid = value
+                elif field == "data":
+                    data.append(value)
+        return True
+
+    async def set(self, key: str, data: any):
+        async with self.sess.post(f"{self.url}/{key}", json=data, timeout=self.timeout) as resp:
+            await self._check(resp)
+
+    async def delete(self, key: str):
+        async with self.sess.delete(f"{self.url}/{key}", timeout=self.timeout) as resp:
+            await self._check(resp)
+
+    async def increment(self, key: str, delta: int, *, minimum: int=None) -> int:
+        """Atomically adds `delta` to `key` on the remote host, returning the new value"""
+        payload = {"increment": delta, "minimum": minimum}
+        async with self.sess.patch(f"{self.url}/{key}", json=payload, timeout=self.timeout) as resp:
+            await self._check(resp)
+            return (await resp.json())["result"]
+
+    async def batch(self, writes: list) -> list:
+        """Atomically applies a list of `(key, op, value, minimum)` writes in one request.
+        Raises `NotImplementedError` if the store doesn't take batches"""
+        payload = {"batch": [dict(key=key, op=op, value=value, minimum=minimum) for key, op, value, minimum in writes]}
+        async with self.sess.patch(self.url, json=payload, timeout=self.timeout) as resp:
+            if resp.status in self.UNSUPPORTED:
+                raise NotImplementedError(f"{resp.status} {resp.reason}")
+            await self._check(resp)
+            return (await resp.json())["result"]
+
+    async def _check(self, resp):
+        """Raises `WriteRejected` if a write failed in a way that retrying won't fix"""
+        if 400 <= resp.status < 500 and resp.status not in self.RETRYABLE:
+            raise WriteRejected(f"{resp.status} {resp.reason}: {(await resp.text())[:200]}")
+        resp.raise_for_status()
+
+    async def close(self):
+        """Closes the session, unless it was given to the backend"""
+        if self._owns_session and self._sess is not None:
+            await self._sess.close()
+
+
+class SQLiteBackend(object):
+    """
+        Keeps the data in an SQLite file on the local disk, with a table each
+        for users, guilds and blacklisted guilds, instead of a remote host.
+        Anything else is kept as JSON in an `extra` table, with a row for each
+        value that isn't an object, so every key `Database.save` takes is stored.
+        Uses the same `one/two` keys as `RESTBackend`, and every query runs
+        on a single background thread so it never blocks the event loop.
+    """
+    TABLES = {
+        "users": ("users", ["money", "bank"]),
+        "guilds": ("guilds", ["prefix", "minecraft", "role"]),
+        "blacklist/guilds": ("blacklist", ["reason"]),
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, money INTEGER, bank INTEGER);
+        CREATE INDEX IF NOT EXISTS users_money ON users (money);
+        CREATE TABLE IF NOT EXISTS guilds (id INTEGER PRIMARY KEY, prefix TEXT, minecraft TEXT, role TEXT);
+        CREATE INDEX IF NOT EXISTS guilds_role ON guilds (role);
+        CREATE TABLE IF NOT EXISTS blacklist (id INTEGER PRIMARY KEY, reason TEXT);
+        CREATE TABLE IF NOT EXISTS extra (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.revision = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+
+    async def _run(self, fn, *args):
+        return await get_event_loop().run_in_executor(self._executor, partial(self._transaction, fn, *args))
+
+    def _transaction(self, fn, *args):
+        """Runs `fn` on the database thread, inside a transaction"""
+        if self._conn is None:
+            self._conn = sqlite_connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.executescript(self.SCHEMA)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try: result = fn(*args)
+        except:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        return result
+
+    # Keys to tables
+    def _locate(self, key: str):
+        """Splits a key for a row or a field into `(prefix, table, columns, rowid, column)`,
+        where `column` is `None` if the key is for the whole row, or `None` if it isn't in a table"""
+        path = [k for k in key.split("/") if k]
+        for prefix, (table, columns) in self.TABLES.items():
+            depth = prefix.count("/") + 1
+            if path[:depth] != prefix.split("/") or len(path) not in [depth + 1, depth + 2]:
+                continue
+            rowid = _rowid(path[depth])
+            column = path[depth + 1] if len(path) > depth + 1 else None
+            if rowid is None or (column is not None and column not in columns):
+                return None
+            return prefix, table, columns, rowid, column
+        return None
+
+    def _tables_under(self, key: str):
+        """Every table that lives under `key`, eg all of them for `""`"""
+        key = key.strip("/")
+        return [p for p in self.TABLES if not key or p == key or p.startswith(f"{key}/")]
+
+    @staticmethod
+    def _scalar(value) -> bool:
+        """Whether `value` can go in a column as it is"""
+        return type(value) in [str, float] or (type(value) is int and -2**63 <= value < 2**63)
+
+    # Database thread functions
+    def _fetch(self) -> dict:
+        data = dict()
+        for prefix, (table, columns) in self.TABLES.items():
+            rows = dict()
+            for row in self._conn.execute(f"SELECT id, {', '.join(columns)} FROM {table}"):
+                fields = {c: v for c, v in zip(columns, row[1:]) if v is not None}
+                if fields:
+                    rows[str(row[0])] = fields["reason"] if table == "blacklist" else fields
+            if rows:
+                reduce(lambda d, k: d.setdefault(k, dict()), prefix.split("/"), data).update(rows)
+
+        for key, value in self._conn.execute("SELECT key, value FROM extra"):
+            path = key.split("/")
+            reduce(lambda d, k: d.setdefault(k, dict()), path[:-1], data)[path[-1]] = loads(value)
+        return data
+
+    def _set(self, key: str, data: any):
+        if data is None:
+            return self._delete(key)
+        key = "/".join(k for k in key.split("/") if k)
+        location = self._locate(key)
+        if location is not None:
+            prefix, table, columns, rowid, column = location
+            if column is not None or table == "blacklist":
+                fits = self._scalar(data)
+            else: fits = isinstance(data, dict)
+        if location is None or not fits:
+            # Not a row or a field, so replace everything under it
+            self._delete(key)
+            if self._tables_under(key) and isinstance(data, dict):
+                [self._set(f"{key}/{k}" if key else k, v) for k, v in data.items()]
+            elif key:
+                self._set_extra(key, data)
+            return data
+
+        self._delete_extra(key)
+        if column is not None:
+            self._conn.execute(f"INSERT OR IGNORE INTO {table} (id) VALUES (?)", (rowid,))
+            self._conn.execute(f"UPDATE {table} SET {column} = ? WHERE id = ?", (data, rowid))
+            return data
+
+        if table == "blacklist":
+            fields = {"reason": data}
+        else:
+            fields = {c: data.get(c) if self._scalar(data.get(c)) else None for c in columns}
+            for field, value in data.items(): # Anything else is kept beside the row
+                if fields.get(field) is None and value is not None:
+                    self._set_extra(f"{key}/{field}", value)
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO {table} (id, {', '.join(fields)}) VALUES (?{', ?' * len(fields)})",
+            (rowid, *fields.values())
+        )
+        return data
+
+    def _set_extra(self, key: str, data: any):
+        """Keeps a value that doesn't fit in the tables as JSON, with a row for each
+        value in it that isn't an object. Anything it's under stops being a single value"""
+        path = key.split("/")
+        for i in range(1, len(path)):
+            parent = "/".join(path[:i])
+            self._conn.execute("DELETE FROM extra WHERE key = ?", (parent,))
+            location = self._locate(parent)
+            if location is not None and (location[4] is not None or location[1] == "blacklist"):
+                self._delete_row(location)
+
+        if isinstance(data, dict):
+            for k, v in data.items():
+                self._set_extra(f"{key}/{k}", v)
+        else: self._conn.execute("INSERT OR REPLACE INTO extra (key, value) VALUES (?, ?)", (key, dumps(data)))
+
+    def _delete(self, key: str):
+        key = "/".join(k for k in key.split("/") if k)
+        self._delete_extra(key)
+        location = self._locate(key)
+        if location is not None:
+            return self._delete_row(location)
+        for prefix in self._tables_under(key):
+            self._conn.execute(f"DELETE FROM {self.TABLES[prefix][0]}")
+
+    def _delete_row(self, location: tuple):
+        """Deletes a row, or a field, removing the row if that was the last one"""
+        prefix, table, columns, rowid, column = location
+        if column is None or len(columns) == 1:
+            self._conn.execute(f"DELETE FROM {table} WHERE id = ?", (rowid,))
+        else:
+            self._conn.execute(f"UPDATE {table} SET {column} = NULL WHERE id = ?", (rowid,))
+            self._conn.execute(f"DELETE FROM {table} WHERE id = ? AND {' AND '.join(f'{c} IS NULL' for c in columns)}", (rowid,))
+
+    def _delete_extra(self, key: str):
+        """Deletes the values kept as JSON at or under `key`"""
+        if not key:
+            return self._conn.execute("DELETE FROM extra")
+        self._conn.execute("DELETE FROM extra WHERE key = ? OR substr(key, 1, ?) = ?", (key, len(key) + 1, f"{key}/"))
+
+    def _increment(self, key: str, delta: int, minimum: int=None) -> int:
+        key = "/".join(k for k in key.split("/") if k)
+        location = self._locate(key)
+        if location is not None and location[4] is not None:
+            prefix, table, columns, rowid, column = location
+            row = self._conn.execute(f"SELECT {column} FROM {table} WHERE id = ?", (rowid,)).fetchone()
+            value = row[0] if row and row[0] is not None else 0
+        else:
+            row = self._conn.execute("SELECT value FROM extra WHERE key = ?", (key,)).fetchone()
+            value = loads(row[0]) if row else 0
+        if type(value) is not int or type(delta) is not int:
+            raise WriteRejected(f"Can't add {delta!r} to {value!r} at {key!r}")
+
+        value += delta
+        value = value if minimum is None else max(value, minimum)
+        self._set(key, value or None)
+        return value
+
+    def _batch(self, writes: list) -> list:
+        results = list()
+        for key, op, value, minimum in writes:
+            if op == "set":
+                results.append(self._set(key, value))
+                continue
+            result = self._increment(key, value, minimum if op == "inc" else None)
+            if op == "transfer" and minimum is not None and result < minimum:
+                raise WriteRejected(f"{key!r} would go below {minimum} ({result})") # Rolls the others back
+            results.append(result)
+        return results
+
+    # Backend functions
+    async def fetch(self, *, if_changed: bool=False) -> dict:
+        """Reading the whole file is quick enough that `if_changed` is ignored"""
+        return await self._run(self._fetch)
+
+    async def stream(self, callback, *, if_changed: bool=False):
+        for section, records in (await self.fetch()).items():
+            if not isinstance(records, dict): # Anything can be saved at the top level
+                callback((section,), records)
+                continue
+            for key, value in records.items():
+                callback((section, key), value)
+
+    async def changes(self, since: int):
+        """Reading the whole file is quick enough, so changes aren't tracked"""
+        return None
+
+    async def set(self, key: str, data: any):
+        await self._run(self._set, key, data)
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def increment(self, key: str, delta: int, *, minimum: int=None) -> int:
+        return await self._run(self._increment, key, delta, minimum)
+
+    async def batch(self, writes: list) -> list:
+        return await self._run(self._batch, writes)
+
+    async def close(self):
+        if self._conn is not None:
+            await get_event_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+ID = compile(r"[1-9][0-9]*\Z") # Keys that are stored as ints
+
+
+def _exactly(kind: type):
+    """A field converter that only accepts values that are already `kind`"""
+    def load(value):
+        if type(value) is not kind:
+            raise TypeError(f"Expected {kind.__name__}, got {type(value).__name__}")
+        return value
+    return load
+
+
+def _rowid(key: str) -> Optional[int]:
+    """The int a table's key is kept as, or `None` if it isn't an id that fits in 64 bits"""
+    if ID.match(key):
+        rowid = int(key)
+        return rowid if rowid < 2**63 else None
+
+
+def _int64(value: int) -> int:
+    """A field converter for ints that fit in an `array("q")`"""
+    if not -2**63 <= _exactly(int)(value) < 2**63:
+        raise ValueError(f"{value} doesn't fit in 64 bits")
+    return value
+
+
+def _id(value: str) -> int:
+    """A field converter for ids that are stored as strings"""
+    if type(value) is not str or not ID.match(value):
+        raise ValueError(f"Not an id: {value!r}")
+    return int(value)
+
+
+def _merge(old, new):
+    """Merges two stored values, keeping `new` if they aren't both dicts"""
+    if old is None or not (isinstance(old, dict) and isinstance(new, dict)):
+        return old if new is None else new
+    merged = dict(old)
+    for k, v in new.items():
+        merged[k] = _merge(merged.get(k), v)
+    return merged
+
+
+class Record(object):
+    """
+        A row of one of the cache's tables. `FIELDS` maps each field to a pair of
+        functions, converting it from and back to the value the remote host stores.
+        Fields that aren't set are `None`, and a record with none set is falsy
+    """
+    __slots__ = ()
+    FIELDS = dict()
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, field) is not None for field in self.FIELDS)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in self.FIELDS)})"
+
+    def set(self, field: str, value) -> bool:
+        """Sets a field from its stored value, returning `False` if it can't be converted"""
+        try:
+            value = self.FIELDS[field][0](value) if bool(value) else None
+        except (TypeError, ValueError):
+            return False
+        setattr(self, field, value if bool(value) else None)
+        return True
+
+    def dump(self, field: str):
+        value = getattr(self, field)
+        return None if value is None else self.FIELDS[field][1](value)
+
+    def to_dict(self) -> dict:
+        return {field: self.dump(field) for field in self.FIELDS if getattr(self, field) is not None}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> Tuple["Record", dict]:
+        """Makes a record from its stored value, also returning any fields it can't hold"""
+        record, extra = cls(), dict()
+        for field, value in data.items():
+            if field not in cls.FIELDS or not record.set(field, value):
+                extra[field] = value
+        return record, extra
+
+
+class GuildRecord(Record):
+    __slots__ = ("prefix", "minecraft", "role")
+    FIELDS = {"prefix": (_exactly(str), str), "minecraft": (_exactly(str), str), "role": (_id, str)}
+
+
+class UserRecord(Record):
+    __slots__ = ("money", "bank")
+    FIELDS = {"money": (_int64, int), "bank": (_int64, int)}
+
+
+class UserTable(object):
+    """
+        The users, stored column by column in arrays of 64 bit ints instead of a record
+        each. Row `i` is the user `ids[i]`, with `money[i]` in their wallet and `bank[i]`
+        in their bank, 0 meaning it isn't set. Rows are found with an open addressing
+        hash index that's an array too, since a dict would take several times the space
+        of the columns. It can be used like a dict of `UserRecord`s, but they're copies
+    """
+    COLUMNS = tuple(UserRecord.FIELDS)
+    EMPTY, DELETED = -1, -2 # Index slots that don't point to a row
+    HASH = 0x9E3779B97F4A7C15 # Spreads out the ids, which don't vary much in their low bits
+    CHUNK = 1024 # Rows looked at together when finding the top values
+
+    def __init__(self):
+        self.ids = array("q")
+        for column in self.COLUMNS:
+            setattr(self, column, array("q"))
+        self._resize(8)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, userid: int) -> bool:
+        return self._find(userid)[1] >= 0
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, userid: int) -> UserRecord:
+        row = self._find(userid)[1]
+        if row < 0:
+            raise KeyError(userid)
+        return self._record(row)
+
+    def __setitem__(self, userid: int, record: UserRecord):
+        slot, row = self._find(userid)
+        values = [getattr(record, column) or 0 for column in self.COLUMNS]
+        if row < 0:
+            if not 0 < userid < 2**63:
+                raise OverflowError(f"User id {userid} doesn't fit in a column")
+            if self._index[slot] == self.EMPTY:
+                self._used += 1
+            row = self._index[slot] = len(self.ids)
+            self.ids.append(userid)
+            for column in self.COLUMNS:
+                getattr(self, column).append(0)
+            if self._used * 3 >= len(self._index) * 2:
+                self._resize(len(self._index) * 2 if len(self.ids) * 3 >= len(self._index) else len(self._index))
+        for column, value in zip(self.COLUMNS, values):
+            getattr(self, column)[row] = value
+
+    def __delitem__(self, userid: int):
+        slot, row = self._find(userid)
+        if row < 0:
+            raise KeyError(userid)
+        self._index[slot] = self.DELETED
+
+        # The last row is moved into the gap, so the columns stay packed
+        last = len(self.ids) - 1
+        if row != last:
+            self._index[self._find(self.ids[last])[0]] = row
+            self.ids[row] = self.ids[last]
+            for column in self.COLUMNS:
+                values = getattr(self, column)
+                values[row] = values[last]
+        self.ids.pop()
+        for column in self.COLUMNS:
+            getattr(self, column).pop()
+
+    def get(self, userid: int, default=None) -> Optional[UserRecord]:
+        try:
+            return self[userid]
+        except KeyError:
+            return default
+
+    def pop(self, userid: int, default=None) -> Optional[UserRecord]:
+        record = self.get(userid, default)
+        if record is not default:
+            del self[userid]
+        return record
+
+    def items(self):
+        for row, userid in enumerate(self.ids):
+            yield userid, self._record(row)
+
+    def clear(self):
+        self.__init__()
+
+    def copy(self) -> "UserTable":
+        """A copy of the whole table, which is only a copy of each array"""
+        table = UserTable.__new__(UserTable)
+        for name in ("ids", "_index") + self.COLUMNS:
+            setattr(table, name, array(getattr(self, name).typecode, getattr(self, name)))
+        table._shift, table._used = self._shift, self._used
+        return table
+
+    def value(self, userid: int, column: str) -> int:
+        """A single value, which is quicker than getting the whole record"""
+        index, ids, mask = self._index, self.ids, len(self._index) - 1
+        slot = (userid * self.HASH & 0xFFFFFFFFFFFFFFFF) >> self._shift
+        while True: # The same as `_find`, but this is used for every balance lookup
+            row = index[slot]
+            if row >= 0 and ids[row] == userid:
+                return getattr(self, column)[row]
+            if row == -1:
+                return 0
+            slot = (slot + 1) & mask
+
+    def _record(self, row: int) -> UserRecord:
+        record = UserRecord()
+        for column in self.COLUMNS:
+            setattr(record, column, getattr(self, column)[row] or None)
+        return record
+
+    def _find(self, userid: int) -> Tuple[int, int]:
+        """The index slot for `userid` and its row, or the slot it
+        would go in and `EMPTY` if it doesn't have one"""
+        index, ids, mask = self._index, self.ids, len(self._index) - 1
+        slot = (userid * self.HASH & 0xFFFFFFFFFFFFFFFF) >> self._shift
+        free = None
+        while True:
+            row = index[slot]
+            if row >= 0:
+                if ids[row] == userid:
+                    return slot, row
+            elif row == self.EMPTY:
+                return (slot if free is None else free), self.EMPTY
+            elif free is None:
+                free = slot
+            slot = (slot + 1) & mask
+
+    def _resize(self, size: int):
+        """Rebuilds the index with `size` slots, which must be a power of 2,
+        leaving out the slots of deleted rows"""
+        self._index = array("i", [self.EMPTY]) * size # Rows fit in 32 bits, which halves the index
+        self._shift = 64 - size.bit_length() + 1
+        self._used = len(self.ids)
+        for row, userid in enumerate(self.ids):
+            self._index[self._find(userid)[0]] = row
+
+    # Whole column operations, which run over the arrays without making any records
+    def top(self, n: int=None, column: str="money") -> List[Tuple[int, int]]:
+        """The `n` users (or everyone) with the most in `column`, as `(userid, value)` pairs"""
+        values = getattr(self, column)
+        starts = range(0, len(values), self.CHUNK)
+        if not n or n > len(starts):
+            least, rows = 1, range(len(values))
+        else:
+            # The `n`th biggest of the chunks' maximums is at most the `n`th biggest value,
+            # so only the chunks with a maximum that big need looking through row by row
+            maxes = list(map(max, (values[start:start + self.CHUNK] for start in starts)))
+            least = max(nlargest(n, maxes)[-1], 1)
+            rows = (
+                row for start, most in zip(starts, maxes) if most >= least
+                for row in range(start, min(start + self.CHUNK, len(values)))
+            )
+        rows = sorted((row for row in rows if values[row] >= least), key=values.__getitem__, reverse=True)
+        return [(self.ids[row], values[row]) for row in rows[:n]]
+
+    def total(self, column: str="money") -> int:
+        return sum(getattr(self, column))
+
+    def count(self, column: str="money") -> int:
+        """The number of users that have something in `column`"""
+        values = getattr(self, column)
+        return len(values) - values.count(0)
+
+
+class Cache(object):
+    """
+        The database's data, with guilds and users kept by their int ids rather than in
+        nested dicts of str keys, guilds as typed records and users in the columns of a
+        `UserTable`. Anything that doesn't fit one of the `TABLES` is kept as it is
+        in `extra`, so exporting it loses nothing.
+        Paths are tuples of the str keys the remote host uses, eg `("guilds", "1", "prefix")`
+    """
+    TABLES = [ # (path, attribute, record type, or `None` to keep values as they are)
+        (("guilds",), "guilds", GuildRecord),
+        (("users",), "users", UserRecord),
+        (("blacklist", "guilds"), "blacklist", None),
+    ]
+
+    def __init__(self):
+        self.guilds = dict() # {guildid: GuildRecord}
+        self.users = UserTable()
+        self.blacklist = dict() # {guildid: reason}
+        self.extra = dict()
+
+    def copy(self) -> "Cache":
+        """A copy that's quick to make, so it can be exported away from the event loop"""
+        cache = Cache()
+        cache.guilds = {guildid: copy(record) for guildid, record in self.guilds.items()}
+        cache.users = self.users.copy()
+        cache.blacklist = dict(self.blacklist)
+        cache.extra = deepcopy(self.extra)
+        return cache
+
+    def load(self, path: tuple, value):
+        """Adds the stored `value` at `path`. Anything already there must be removed first"""
+        if value is None:
+            return
+        for prefix, name, kind in self.TABLES:
+            if path and path[0] != prefix[0]:
+                continue
+            depth = len(path) - len(prefix)
+            if depth <= 0:
+                if prefix[:len(path)] != path:
+                    continue
+                if not isinstance(value, dict):
+                    break
+                for k, v in value.items(): # Split it up between the tables
+                    self.load(path + (k,), v)
+                return
+
+            rowid = _rowid(path[len(prefix)]) if path[:len(prefix)] == prefix else None
+            if rowid is None:
+                continue
+            table = getattr(self, name)
+            if kind is None:
+                if depth == 1 and not isinstance(value, dict):
+                    table[rowid] = value
+                    return
+            elif depth == 1 and isinstance(value, dict):
+                record, extra = kind.from_dict(value)
+                if record: table[rowid] = record
+                for field, v in extra.items():
+                    self._load_extra(path + (field,), v)
+                return
+            elif depth == 2 and path[-1] in kind.FIELDS:
+                record = table.get(rowid) or kind()
+                if record.set(path[-1], value):
+                    if record: table[rowid] = record
+                    return
+            elif depth > 2 and path[len(prefix) + 1] in kind.FIELDS and rowid in table:
+                self._clear(table, rowid, path[len(prefix) + 1]) # It's becoming a dict
+            if kind is None:
+                table.pop(rowid, None)
+            break
+        self._load_extra(path, value)
+
+    def _load_extra(self, path: tuple, value):
+        if not path:
+            self.extra = value if isinstance(value, dict) else dict()
+            return
+        parent = self.extra
+        for k in path[:-1]:
+            if not isinstance(parent.get(k), dict):
+                parent[k] = dict()
+            parent = parent[k]
+        parent[path[-1]] = value
+
+    def write(self, path: tuple, value):
+        """Replaces whatever is stored at `path` with `value`, removing it if it's falsy"""
+        self.remove(path)
+        if not bool(value):
+            return
+        parent = self.extra # Anything that isn't a dict above `path` becomes one
+        for i, k in enumerate(path[:-1]):
+            if not isinstance(parent.get(k), dict):
+                if k in parent: self.remove(path[:i + 1])
+                break
+            parent = parent[k]
+        self.load(path, value)
+
+    def remove(self, path: tuple):
+        """Removes whatever is stored at `path`, and any parents left empty by that"""
+        for prefix, name, kind in self.TABLES:
+            table = getattr(self, name)
+            if prefix[:len(path)] == path:
+                table.clear()
+            elif path[:len(prefix)] == prefix and _rowid(path[len(prefix)]) is not None:
+                rowid, rest = _rowid(path[len(prefix)]), path[len(prefix) + 1:]
+                if not rest:
+                    table.pop(rowid, None)
+                elif kind is not None and len(rest) == 1 and rest[0] in kind.FIELDS and rowid in table:
+                    self._clear(table, rowid, rest[0])
+
+        if not path:
+            self.extra = dict()
+            return
+        parents = [self.extra]
+        for k in path[:-1]:
+            child = parents[-1].get(k)
+            if not isinstance(child, dict):
+                return # Nothing there to remove
+            parents.append(child)
+        parents[-1].pop(path[-1], None)
+        for parent, k in reversed(list(zip(parents[:-1], path[:-1]))):
+            if parent[k]: break
+            del parent[k]
+
+    def _clear(self, table: dict, rowid: int, field: str):
+        record = table[rowid]
+        setattr(record, field, None)
+        if record:
+            table[rowid] = record
+        else: del table[rowid]
+
+    def export(self, path: tuple=()):
+        """The value stored at `path` in the same shape as the remote host, or `None`"""
+        value = None
+        if self.extra: # Usually there's nothing outside the tables
+            value = reduce(lambda d, k: d.get(k) if isinstance(d, dict) else None, path, self.extra)
+        for prefix, name, kind in self.TABLES:
+            if path and path[0] != prefix[0]:
+                continue
+            table = getattr(self, name)
+            if prefix[:len(path)] == path:
+                if not table:
+                    continue
+                rows = {str(rowid): row if kind is None else row.to_dict() for rowid, row in table.items()}
+                value = _merge(value, reduce(lambda rows, k: {k: rows}, reversed(prefix[len(path):]), rows))
+            elif path[:len(prefix)] == prefix and _rowid(path[len(prefix)]) is not None:
+                row, rest = table.get(_rowid(path[len(prefix)])), path[len(prefix) + 1:]
+                if row is None or (rest and kind is None):
+                    continue
+                if not rest:
+                    value = _merge(value, row if kind is None else row.to_dict())
+                elif len(rest) == 1 and rest[0] in kind.FIELDS:
+                    value = _merge(value, row.dump(rest[0]))
+        return value
 
 
 class Database(object):
     """
         Represents a database connection
 
-        This stores the data in a read-only cache property (`cache`).
+        This stores the data in a typed `Cache`, which the accessors like `guild_prefix`
+        and `user_money` read directly. The read-only `cache` property and the string
+        paths used by `get` and `save` still work, in the shape the remote host uses.
         Internal methods can also be used as shortcuts for updating data quickly
     """
     TIMEOUT = 5
+    FLUSH_SIZE = 50 # Number of pending writes that triggers a flush
+    FLUSH_DELAY = 5 # Seconds a write can wait before being flushed
+    FLUSH_RETRIES = 3
+    MAX_PENDING = 5000 # Number of pending writes that makes writers wait for a flush
+    SYNC_INTERVAL = 30 # Seconds between syncs, however often we reconnect
+    LISTEN_RETRY = 1 # Seconds before reconnecting to the remote host's event stream, doubling each failure
+    LISTEN_RETRY_MAX = 60
+    SNAPSHOT_VERSION = 1
     
     LEADERBOARD_EMOJI_KEY = {1: "👑", 2: "🔱", 3: "🏆"}
     LEADERBOARD_URL_KEY = {1:"98fe9cdec2bf8ded782a7bf1e302b664", 2:"7d7c9561cc5ab5259ff8023b8ef86c99", 3:"0a00e865c445d42dfb9f64bedfab8cf8"}
@@ -24,22 +1221,61 @@ class Database(object):
     LEADERBOARD_DEFAULT_URL = "d702f2335a85d421e708bc9466571fa8"
 
     # Setup functions
-    def __init__(self, url:str=getenv("DATABASE_URL"), *, timeout:int=TIMEOUT, sess:ClientSession=None):
-        self.__url = url
+    def __init__(self, url:str=getenv("DATABASE_URL"), *, timeout:int=TIMEOUT, sess:ClientSession=None,
+                 connector:BaseConnector=None, backend=None, snapshot:str=None):
+        """`backend` can be anything with the same methods as `RESTBackend`, otherwise
+        one is picked for `url`. Urls like `sqlite:///path/to/file.db` use
+        `SQLiteBackend`, and anything else is treated as a `RESTBackend`, which
+        uses `sess`, or a session of its own on `connector`'s connection pool.
+        If `snapshot` is a file path, the cache is saved there and loaded from it on startup.
+        Nothing connects to anything until it's needed, so this can be made anywhere,
+        but `create` can be awaited to get a database with its cache filled"""
+        self.url = url
         self.TIMEOUT = timeout
+        self.snapshot = snapshot
 
-        self._cache = dict()
+        self._cache = Cache()
         self._requested = False
-        self.guild_server_ips = dict()
-        self.guild_minecraft_roles = dict()
+        self.guild_server_ips = dict() # {guildid: serverip}
+        self.guild_minecraft_roles = dict() # {guildid: roleid}
+        self.server_ip_guilds = dict() # {serverip: {guildid}}
+        self.minecraft_role_guilds = dict() # {roleid: guildid}
+        self.leaderboard = Leaderboard(self._cache.users)
+        self.prefixes = PrefixResolver()
+        self._subscribers = list() # [(callback, event types)]
+        self.logger = getLogger("bot.database")
+
+        # Writes waiting to be sent as {key: (op, data, minimum)}, with transfers as
+        # {number: ("batch", [(key, op, data, minimum)], None)}, since they're sent together
+        self._pending = dict()
+        self._inflight = dict() # The same, for the writes currently being sent
+        self._transfers = count()
+        self._downloads = 0 # Downloads running right now
+        self._flushed = dict() # {key: value} the remote host took while a download was running
+        self._batches = True # Whether the backend takes batches, until it turns out not to
+        self._flush_lock = Lock()
+        self._flush_timer = None
+        self._sync_lock = Lock()
+        self._synced = 0
+        self._snapshot_due = False # A snapshot was skipped because writes were waiting
+        self._snapshot_lock = Lock() # So snapshots being written don't share the temporary file
+        self._listener = None
         
-        self.sess = sess if isinstance(sess, ClientSession) else get_event_loop().run_until_complete(self.__create_session())
-    
-    async def __create_session(self) -> ClientSession:
-        return ClientSession(headers={
-            "Accept": "application/json",
-            "Content-type": "application/json",
-        })
+        if backend is None and str(url).startswith("sqlite://"):
+            backend = SQLiteBackend(url[len("sqlite://"):])
+        self.backend = backend or RESTBackend(url, sess, connector=connector, timeout=timeout)
+        if snapshot: self.load_snapshot()
+
+    @classmethod
+    async def create(cls, *args, **kwargs) -> "Database":
+        """Makes a database, taking the same arguments, and connects it"""
+        db = cls(*args, **kwargs)
+        await db.connect()
+        return db
+
+    async def connect(self):
+        """Fills the cache from the remote host, or brings the snapshot up to date"""
+        await self.sync()
     
     # Properties
     @property
@@ -49,28 +1285,198 @@ class Database(object):
     
     @property
     def cache(self) -> dict:
-        return self._cache
+        """The whole cache in the shape the remote host stores it. This is
+        put together each time, so use `get` or the accessors for single values"""
+        return self._cache.export() or dict()
+
+    @property
+    def listening(self) -> bool:
+        """Indicates if the remote host's writes are being followed as they happen"""
+        return self._listener is not None and not self._listener.done()
+
+    @property
+    def pending(self) -> int:
+        """The number of writes waiting to be sent to the remote host"""
+        return len(self._pending)
 
     # Get/set functions
-    async def update_cache(self) -> "cache":
+    async def update_cache(self):
         """
             Updates the internal cache with the data that is stored in the remote host.
-            This should prevent API abuse and lag by requesting data all the time.
-        """
-        self._cache = await self.get("") or dict()
-        self.guild_minecraft_roles = {
-            g: self._cache["guilds"][g]["role"]
-            for g in self._cache["guilds"]
-            if self._cache["guilds"][g].get("role")
-        } if self._cache.get("guilds") else dict()
-        self.guild_server_ips = {
-            g: self._cache["guilds"][g]["minecraft"]
-            for g in self._cache["guilds"]
-            if self._cache["guilds"][g].get("minecraft")
-        } if self._cache.get("guilds") else dict()
+            Writes are applied to the cache locally, so this is only needed on
+            startup and for the occasional reconciliation with the remote host.
+        """
+        # The old cache is still used until the download has finished
+        cache = Cache()
+        self._downloads += 1
+        try: result = await self.backend.stream(cache.load, if_changed=self.ready)
+        finally: flushed = self._end_download()
+        self._synced = time()
+        if result is NOT_MODIFIED:
+            return # Nothing to parse or rebuild
+
+        self._cache = cache
+        self._rebuild_indexes()
+        self._replay_pending(flushed=flushed)
 
         self._requested = True
-        return self._cache
+        await self.save_snapshot()
+
+    async def sync(self):
+        """
+            Brings the cache up to date, only fetching the changes since the last
+            download if the backend can tell, otherwise downloading everything.
+            Calls while a sync is running, or soon after one, don't fetch again.
+        """
+        if self._sync_lock.locked() or time() - self._synced < self.SYNC_INTERVAL:
+            async with self._sync_lock:
+                return
+
+        async with self._sync_lock:
+            changes = None
+            if self.ready and self.backend.revision is not None:
+                self._downloads += 1
+                try: changes = await self.backend.changes(self.backend.revision)
+                finally: flushed = self._end_download()
+            if changes is None:
+                return await self.update_cache()
+
+            for key, data in changes:
+                self._apply(key, data)
+            self._replay_pending([key for key, _ in changes], flushed=flushed)
+
+            self._synced = time()
+            await self.save_snapshot()
+
+    # Live changes
+    def listen(self):
+        """
+            Starts following the writes made to the remote host as they happen, applying
+            them to the cache straight away, if the backend supports it. This keeps going
+            in the background, reconnecting and picking up where it left off whenever
+            the connection drops. Returns the task doing it, or `None` if unsupported.
+            It stops if the remote host turns out not to send events or keep a revision.
+        """
+        if not hasattr(self.backend, "listen"):
+            return None
+        if self._listener is None or self._listener.done():
+            self._listener = ensure_future(self._listen())
+        return self._listener
+
+    async def _listen(self):
+        delay = self.LISTEN_RETRY
+        while True:
+            connected = time()
+            try:
+                if not self.ready or self.backend.revision is None:
+                    await self.update_cache() # Nothing to resume from
+                    if self.backend.revision is None:
+                        return self.logger.warning("The database doesn't keep a revision to follow its changes from")
+                resumed = await self.backend.listen(self._apply_remote)
+                if resumed is None:
+                    return self.logger.warning("The database doesn't send events, so its changes can't be followed")
+                if resumed is False:
+                    self.logger.info("Missed too many database changes to resume, downloading everything")
+                    await self.update_cache()
+                else: self.logger.debug("The database event stream was closed")
+            except Exception as err:
+                self.logger.warning(f"Lost the database event stream: {err!r}")
+
+            # Streams that close straight away back off too, so reconnects
+            # that need a download don't become downloads in a tight loop
+            if time() - connected >= self.LISTEN_RETRY_MAX:
+                delay = self.LISTEN_RETRY
+            self.logger.debug(f"Reconnecting to the database event stream in {delay}s")
+            await sleep(delay)
+            delay = min(delay * 2, self.LISTEN_RETRY_MAX)
+
+    def _apply_remote(self, key: str, data: any):
+        """Applies a write someone made to the remote host, which could be
+        one of ours coming back, with any of our newer writes on top"""
+        self._apply(key, data)
+        self._replay_pending([key])
+        self._synced = time()
+
+    def _end_download(self) -> dict:
+        """Stops counting a download as running, returning the writes
+        the remote host took while it was, as `{key: value}`"""
+        self._downloads -= 1
+        flushed = self._flushed
+        if not self._downloads:
+            self._flushed = dict()
+        return flushed
+
+    def _replay_pending(self, keys: list=None, *, flushed: dict=None):
+        """
+            Writes that haven't reached the remote host yet are newer than anything
+            just downloaded, so they're applied again, as are the values it took for
+            the `flushed` writes, since the download could have been from before them.
+            If `keys` is specified, only writes overlapping those keys are. Increments
+            being sent right now are left to `flush` to settle.
+        """
+        overlaps = lambda key: keys is None or any(
+            not k or k == key or key.startswith(f"{k}/") or k.startswith(f"{key}/") for k in keys
+        )
+        for key, data in (flushed or dict()).items():
+            if overlaps(key):
+                self._apply(key, data)
+        for key, op, data, minimum in self._writes(self._inflight):
+            if op == "set" and overlaps(key):
+                self._apply(key, data)
+        for key, op, data, minimum in self._writes(self._pending):
+            if not overlaps(key):
+                continue
+            if op != "set":
+                data += self._lookup(key, 0)
+                data = data if minimum is None else max(data, minimum)
+            self._apply(key, data)
+
+    # Snapshots
+    def load_snapshot(self) -> bool:
+        """
+            Fills the cache from the snapshot file, so the bot has its data straight
+            away instead of waiting for a download. `sync` then only needs to fetch
+            what changed since it was saved. Returns whether a snapshot was loaded.
+        """
+        try:
+            with open(self.snapshot, encoding="utf-8") as f:
+                snapshot = loads(f.read())
+        except (OSError, ValueError):
+            return False
+        if snapshot.get("version") != self.SNAPSHOT_VERSION or snapshot.get("url") != self.url:
+            return False # Old format, or a different database
+
+        self._cache = Cache()
+        self._cache.load((), snapshot["data"])
+        self.backend.revision = snapshot["revision"]
+        self._rebuild_indexes()
+        self._requested = True
+        return True
+
+    async def save_snapshot(self):
+        """Saves the cache to the snapshot file, if there's nothing waiting to be sent,
+        since the snapshot could otherwise hold writes the remote host never got. If there
+        is, it's saved after the next flush that leaves nothing waiting instead, so on a bot
+        that always has writes waiting, it's only saved by `close`"""
+        if not self.snapshot or not self.ready:
+            return
+        if self._pending or self._inflight:
+            self._snapshot_due = True
+            return
+        self._snapshot_due = False
+
+        # Exporting everything takes seconds with a lot of users, so only the copying is done here
+        cache, revision = self._cache.copy(), self.backend.revision
+        async with self._snapshot_lock:
+            await get_event_loop().run_in_executor(None, self._write_snapshot, cache, revision)
+
+    def _write_snapshot(self, cache: Cache, revision: Optional[int]):
+        data = dumps(dict(
+            version=self.SNAPSHOT_VERSION, url=self.url, revision=revision, data=cache.export() or dict(),
+        ), separators=(",", ":"))
+        with open(f"{self.snapshot}.tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        replace(f"{self.snapshot}.tmp", self.snapshot)
 
     async def get(self, key: str, default=None):
         """
@@ -81,25 +1487,382 @@ class Database(object):
 
         # Fetch the data
         if not bool(key):
-            async with self.sess.get(self.__url) as resp:
-                return (await resp.json())["result"]
+            return await self.backend.fetch()
         
         # Get the data
-        return reduce(lambda d, k: d.get(k, default) if isinstance(d, dict) else default, key.split("/"), self._cache)
+        return self._lookup(key, default)
+
+    def _lookup(self, key: str, default=None):
+        path = key.split("/")
+        if len(path) == 3 and path[0] == "users" and path[2] in UserTable.COLUMNS and "users" not in self._cache.extra:
+            rowid = _rowid(path[1]) # Balances are looked up by every increment and transfer
+            if rowid is not None:
+                return self._cache.users.value(rowid, path[2]) or default
+        value = self._cache.export(tuple(filter(None, path)))
+        return default if value is None else value
 
     async def save(self, key: str, data: any):
-        url = f"{self.__url}/{key}"
-        if bool(data):
-            async with self.sess.post(url, json=data, timeout=self.TIMEOUT) as resp:
-                resp.raise_for_status()
-            return await self.update_cache()
-        await self.delete(key)
+        """
+            Saves `data` under `key`. The cache is updated straight away, but the write
+            itself is buffered and sent to the remote host in the background by `flush`.
+            Falsy `data` deletes the key.
+        """
+        data = data if bool(data) else None
+        self._apply(key, data)
+        self._queue(key, data)
+        await self._wait_for_room()
     
     async def delete(self, key: str):
-        url = f"{self.__url}/{key}"
-        async with self.sess.delete(url, timeout=self.TIMEOUT) as resp:
-            resp.raise_for_status()
-        await self.update_cache()
+        await self.save(key, None)
+
+    async def delete_many(self, keys: Iterable[str]):
+        """
+            Deletes every key in `keys` at once. They're removed from the cache and queued
+            in a single pass, so they all go to the remote host in the same batch, rather
+            than one write at a time. Waits while the buffer is full, like `save` does.
+        """
+        keys = list(dict.fromkeys(key.strip("/") for key in keys))
+        for key in keys:
+            self._apply(key, None)
+
+        # Pending writes under any of the keys are dropped, checking each pending key's parents
+        deleted = set(keys)
+        def obsolete(key: str) -> bool:
+            path = key.split("/")
+            return "" in deleted or any("/".join(path[:i]) in deleted for i in range(1, len(path) + 1))
+        self._pending = {key: write for key, write in self._pending.items() if not isinstance(key, str) or not obsolete(key)}
+        self._pending.update((key, ("set", None, None)) for key in keys)
+
+        if keys: self._schedule_flush(0 if len(self._pending) >= self.FLUSH_SIZE else self.FLUSH_DELAY)
+        await self._wait_for_room()
+
+    async def increment(self, key: str, delta: int, *, minimum: int=None) -> int:
+        """
+            Adds `delta` to the number stored under `key`, never going below `minimum`,
+            and returns the new value. The cache is updated straight away, and the remote
+            host applies the delta itself, so concurrent increments are never lost.
+        """
+        old = self._lookup(key, 0)
+        new = old + delta if minimum is None else max(old + delta, minimum)
+        self._apply(key, new)
+        self._queue(key, new - old, op="inc", minimum=minimum)
+        await self._wait_for_room()
+        return new
+
+    async def transfer(self, *legs: Tuple[str, int], minimum: int=0) -> List[int]:
+        """
+            Adds each `(key, delta)` leg together, eg moving 5 from one wallet to another is
+            `transfer(("users/1/money", -5), ("users/2/money", 5))`. The legs are sent to the
+            remote host in a batch of their own, so either all of them are applied or none are.
+            Raises `ValueError` without changing anything if a leg would go below `minimum`.
+            If the remote host has less than the cache, and a leg would go below `minimum`
+            there, it rejects the whole transfer, and it's undone in the cache too.
+        """
+        new = dict()
+        for key, delta in legs:
+            new[key] = new.get(key, self._lookup(key, 0)) + delta
+            if new[key] < minimum:
+                raise ValueError(f"{key!r} would go below {minimum} ({new[key]})")
+
+        for key, value in new.items():
+            self._apply(key, value)
+
+        # Pending writes to the same keys go first in the batch, so nothing queued later can get ahead of them
+        keys = [key.strip("/") for key, _ in legs]
+        overlaps = lambda k: isinstance(k, str) and any(
+            not k or k == key or key.startswith(f"{k}/") or k.startswith(f"{key}/") for key in keys
+        )
+        writes = [(k, *self._pending.pop(k)) for k in [k for k in self._pending if overlaps(k)]]
+        writes += [(key, "transfer", delta, minimum) for key, (_, delta) in zip(keys, legs)]
+        self._pending[next(self._transfers)] = ("batch", writes, None)
+        self._flush_soon()
+        await self._wait_for_room()
+        return [new[key] for key, _ in legs]
+
+    # Write-behind buffer
+    def _queue(self, key: str, data: any, *, op: str="set", minimum: int=None):
+        """
+            Buffers a write, merging it with any pending write it makes redundant.
+            Increments to the same key are added together, and clamped by the
+            remote host once the total is applied.
+        """
+        key = key.strip("/")
+        previous = self._pending.pop(key, None)
+        for k in [k for k in self._pending if isinstance(k, str) and (not key or k.startswith(f"{key}/"))]:
+            del self._pending[k]
+
+        if op == "inc" and previous is not None:
+            if previous[0] == "inc":
+                data += previous[1]
+            else: # Pending value is already in the cache
+                op, data = "set", self._lookup(key)
+        self._pending[key] = (op, data, minimum)
+        self._flush_soon()
+
+    def _flush_soon(self):
+        if len(self._pending) >= self.FLUSH_SIZE:
+            self._schedule_flush(0)
+        elif self._flush_timer is None:
+            self._schedule_flush(self.FLUSH_DELAY)
+
+    async def _wait_for_room(self):
+        """Holds writers up while `MAX_PENDING` writes are waiting, so the buffer can't
+        grow without limit while the remote host is slow, or down"""
+        while len(self._pending) >= self.MAX_PENDING:
+            if not await self.flush():
+                await sleep(self.FLUSH_DELAY)
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._flush_timer = get_event_loop().call_later(delay, lambda: ensure_future(self.flush()))
+
+    async def flush(self) -> bool:
+        """
+            Sends all the pending writes to the remote host, in a single batch if it takes
+            them all. Otherwise the batch is split up until the write it won't take is found,
+            which is dropped, so one bad write can't hold up the rest. Writes that fail any
+            other way are put back to be retried later. Returns whether nothing was put back.
+        """
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return True
+
+            self._inflight, self._pending = self._pending, dict()
+            try: unsent = await self._send(list(self._inflight.items()))
+            finally: self._inflight = dict()
+            if unsent:
+                self._requeue(unsent)
+                self._schedule_flush(self.FLUSH_DELAY)
+        if self._snapshot_due:
+            await self.save_snapshot()
+        return not unsent
+
+    async def _send(self, entries: list) -> list:
+        """
+            Sends `[(key, write)]` entries from the buffer in one batch. If the remote host
+            rejects it, it's split in half and each half is sent on its own, until the entry
+            it won't take is found and dropped. Returns the entries that couldn't be sent
+            for any other reason, to be tried again.
+        """
+        writes = self._writes(entries)
+        try:
+            writes, results = await self._batch(writes)
+        except WriteRejected as err:
+            if len(entries) > 1:
+                half = len(entries) // 2
+                unsent = await self._send(entries[:half])
+                return unsent + entries[half:] if unsent else await self._send(entries[half:])
+            self.logger.error(f"The database rejected {dumps(writes)}, dropping it: {err}")
+            self._rejected(*entries[0])
+            return []
+        except Exception as err:
+            self.logger.error(f"Failed to flush {len(writes)} database writes: {err!r}")
+            return entries
+
+        # Results of writes that a later one in the batch replaced, or replaced a parent of, are out of date
+        replaced, stale = set(), list()
+        for key, op, data, minimum in reversed(writes):
+            path = key.split("/")
+            stale.append(any("/".join(path[:i]) in replaced for i in range(len(path) + 1)))
+            if op == "set": replaced.add(key)
+        stale.reverse()
+
+        transferring = {key for key, op, data, minimum in self._writes(self._pending) if op == "transfer"}
+        for (key, op, data, minimum), result, outdated in zip(writes, results, stale):
+            if outdated:
+                continue
+            if self._downloads: # A download running now could be from before this
+                self._flushed.pop(key, None)
+                self._flushed[key] = result
+            # Otherwise the event stream, or the pending transfer, brings the result
+            if op != "set" and not self.listening and key not in transferring:
+                self._resolve(key, result)
+        return []
+
+    async def _batch(self, writes: list) -> Tuple[list, list]:
+        """
+            Sends writes with the backend's `batch`, or if it doesn't take batches, one at a time
+            as the values they left in the cache, the way they were sent before there were any.
+            Returns the writes as they were sent, and the values the remote host took for them.
+        """
+        if self._batches:
+            try: return writes, await self.backend.batch(writes)
+            except NotImplementedError as err:
+                self.logger.warning(f"The database doesn't take batches ({err}), so writes are sent one at a time")
+                self._batches = False
+
+        # Without batches, transfers can't be checked against the remote host's balances either
+        writes = [(key, "set", data if op == "set" else self._lookup(key), None) for key, op, data, minimum in writes]
+        for key, op, data, minimum in writes:
+            if data is None:
+                await self.backend.delete(key)
+            else: await self.backend.set(key, data)
+        return writes, [data for key, op, data, minimum in writes]
+
+    def _requeue(self, entries: list):
+        """Puts `[(key, write)]` entries that weren't sent back at the front of the buffer,
+        unless a newer write has replaced them, merging them into newer increments"""
+        front = dict()
+        for key, write in entries:
+            if isinstance(key, str):
+                if any(isinstance(k, str) and (not k or key.startswith(f"{k}/")) for k in self._pending):
+                    continue # A parent has been written since
+                newer = self._pending.get(key)
+                if newer is not None:
+                    if newer[0] == "inc" and write[0] == "inc": # Both deltas still need applying
+                        self._pending[key] = ("inc", write[1] + newer[1], newer[2])
+                    elif newer[0] == "inc":
+                        self._pending[key] = ("set", self._lookup(key), None)
+                    continue
+            front[key] = write
+        self._pending = {**front, **self._pending}
+
+    def _rejected(self, key, write: tuple):
+        """Undoes a transfer the remote host rejected, and puts back any other writes
+        that were sent along with it. Other writes are left in the cache, which could
+        now be different to the remote host until the next reconcile"""
+        if write[0] != "batch":
+            return
+        for k, op, delta, minimum in write[1]:
+            if op == "transfer":
+                self._apply(k, self._lookup(k, 0) - delta)
+        self._requeue([(k, (op, data, minimum)) for k, op, data, minimum in write[1] if op != "transfer"])
+
+    @staticmethod
+    def _writes(entries) -> List[tuple]:
+        """Every `(key, op, data, minimum)` write in `{key: write}` or `[(key, write)]` buffer
+        entries, in order, with the transfers' writes in place of the transfers"""
+        entries = entries.items() if isinstance(entries, dict) else entries
+        return [w for key, write in entries for w in (write[1] if write[0] == "batch" else [(key, *write)])]
+
+    def _resolve(self, key: str, value: int):
+        """Replaces a locally computed increment with the value the remote host
+        settled on, keeping any newer writes to the key on top of it"""
+        newer = self._pending.get(key)
+        if newer is None:
+            self._apply(key, value)
+        elif newer[0] == "inc":
+            value += newer[1]
+            self._apply(key, value if newer[2] is None else max(value, newer[2]))
+
+    async def close(self):
+        """Flushes any pending writes, retrying a few times, then closes the session"""
+        for attempt in range(self.FLUSH_RETRIES):
+            if await self.flush():
+                break
+            await sleep(2 ** attempt)
+        else:
+            self.logger.error(f"Lost {len(self._pending)} database writes: {dumps(self._pending)}")
+        await self.save_snapshot()
+
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        if self._listener is not None:
+            self._listener.cancel()
+        await self.backend.close()
+
+    # Local cache maintenance
+    def _apply(self, key: str, data: any):
+        """
+            Applies a write to the local cache in place, rather than downloading
+            the whole database again. Falsy `data` removes the key, and any parents
+            left empty by that, the same way the remote host does.
+        """
+        path = tuple(k for k in key.split("/") if k)
+        rowid = _rowid(path[1]) if len(path) > 1 and path[0] in ["guilds", "users"] else None
+        if rowid is not None and path[0] == "users":
+            old = [self._cache.users.value(rowid, account) for account in UserRecord.FIELDS]
+        self._cache.write(path, data)
+
+        # Only the affected guild or user's entries need to change
+        if not path or (len(path) == 1 and path[0] in ["guilds", "users"]):
+            return self._rebuild_indexes()
+        if rowid is None:
+            return
+        if path[0] == "guilds":
+            self._update_guild_indexes(rowid)
+        else: self._update_user_indexes(rowid, old)
+
+    def _rebuild_indexes(self):
+        """Brings the guild role/server/prefix lookups up to date with the whole cache,
+        publishing what changed, and rebuilds the leaderboard"""
+        guilds = set(self._cache.guilds).union(self.guild_minecraft_roles, self.guild_server_ips, self.prefixes)
+        for g in guilds:
+            self._update_guild_indexes(g)
+
+        self._rebuild_leaderboard()
+        self._publish(CacheReloaded())
+
+    def _rebuild_leaderboard(self):
+        self.leaderboard.load(self._cache.users)
+
+    def _update_guild_indexes(self, guildid: int):
+        """Updates the role/server/prefix lookups for a single guild, both ways round,
+        and publishes the settings that are different to what they had"""
+        guild = self._cache.guilds.get(guildid)
+        old = dict(
+            prefix=self.prefixes.get(guildid), minecraft=self.guild_server_ips.get(guildid),
+            role=self.guild_minecraft_roles.get(guildid),
+        )
+        self.prefixes.set(guildid, None if guild is None else guild.prefix)
+
+        role = self.guild_minecraft_roles.pop(guildid, None)
+        if role is not None and self.minecraft_role_guilds.get(role) == guildid:
+            del self.minecraft_role_guilds[role]
+        if guild is not None and guild.role is not None:
+            self.guild_minecraft_roles[guildid] = guild.role
+            self.minecraft_role_guilds[guild.role] = guildid
+
+        ip = self.guild_server_ips.pop(guildid, None)
+        if ip is not None:
+            self.server_ip_guilds[ip].discard(guildid)
+            if not self.server_ip_guilds[ip]: del self.server_ip_guilds[ip]
+        if guild is not None and guild.minecraft is not None:
+            self.guild_server_ips[guildid] = guild.minecraft
+            self.server_ip_guilds.setdefault(guild.minecraft, set()).add(guildid)
+
+        for setting, value in old.items():
+            new = None if guild is None else getattr(guild, setting)
+            if new != value:
+                self._publish(GuildSettingChanged(guildid, setting, value, new))
+        if guild is None and any(value is not None for value in old.values()):
+            self._publish(GuildDeleted(guildid))
+
+    def _update_user_indexes(self, userid: int, old: List[int]):
+        """Updates a single user's place on the leaderboard, and publishes
+        the balances that are different to the `old` ones"""
+        self.leaderboard.update(userid, old[0])
+        for account, value in zip(UserRecord.FIELDS, old):
+            new = self._cache.users.value(userid, account)
+            if new != value:
+                self._publish(BalanceChanged(userid, account, value, new))
+
+    # Change notifications
+    def subscribe(self, callback, *events: type):
+        """
+            Calls `callback(event)` with every change published, or only the ones that
+            are instances of `events`, straight after it's applied to the cache. The
+            coroutine returned by an `async` callback is scheduled to run separately.
+        """
+        self._subscribers.append((callback, events))
+
+    def unsubscribe(self, callback):
+        self._subscribers = [(c, events) for c, events in self._subscribers if c != callback]
+
+    def _publish(self, event: NamedTuple):
+        for callback, events in self._subscribers:
+            if events and not isinstance(event, events):
+                continue
+            try:
+                result = callback(event)
+                if isawaitable(result):
+                    ensure_future(result)
+            except Exception:
+                self.logger.exception(f"Subscriber {callback!r} failed to handle {event!r}")
 
     # Thanos snap data
     async def double_thanos(self, data="none"):
@@ -115,7 +1878,6 @@ class Database(object):
             await self.delete("guilds")
         if data in ["user", "users"]:
             await self.delete("users")
-        await self.update_cache()
 
     async def delete_guild(self, guildid: int):
         await self.delete(f"guilds/{guildid}")
@@ -123,6 +1885,9 @@ class Database(object):
     async def delete_user(self, userid: int):
         await self.delete(f"users/{userid}")
 
+    async def delete_users(self, userids: Iterable[int]):
+        await self.delete_many(f"users/{userid}" for userid in userids)
+
     # Blacklisting
     async def blacklist_guild(self, guildid: int, reason="No reason provided"):
         return await self.save(f"blacklist/guilds/{guildid}", reason)
@@ -131,28 +1896,63 @@ class Database(object):
         return await self.delete(f"blacklist/guilds/{guildid}")
 
     async def is_guild_blacklisted(self, guildid: int):
-        return bool(await self.get(f"blacklist/guilds/{guildid}"))
+        return guildid in self._cache.blacklist
+
+    # Guild settings
+    async def update_guild(self, guildid: int, **fields):
+        """
+            Sets any of a guild's settings at once, eg `update_guild(1234, prefix="?", role=None)`.
+            Falsy values clear the setting. The cache is updated once, and the fields are
+            queued together, so they normally reach the remote host in the same batch. Each
+            is still a write of its own though, so if it rejects one, only that one is dropped.
+        """
+        unknown = set(fields).difference(GuildRecord.FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown guild settings: {', '.join(sorted(unknown))}")
+        if not fields:
+            return
+        fields = {field: GuildRecord.FIELDS[field][1](value) if value else None for field, value in fields.items()}
+
+        key = f"guilds/{guildid}"
+        guild = self._lookup(key, dict())
+        guild = {**(guild if isinstance(guild, dict) else dict()), **fields}
+        self._apply(key, {field: value for field, value in guild.items() if value is not None})
+        for field, value in fields.items():
+            self._queue(f"{key}/{field}", value)
+        await self._wait_for_room()
 
     # Guild prefixes
     async def set_guild_prefix(self, guildid: int, prefix: str):
-        return await self.save(f"guilds/{guildid}/prefix", prefix)
+        return await self.update_guild(guildid, prefix=prefix)
 
     async def get_guild_prefix(self, guildid: int):
-        return await self.get(f"guilds/{guildid}/prefix", None)
+        return self.guild_prefix(guildid)
+
+    def guild_prefix(self, guildid: int) -> Optional[str]:
+        guild = self._cache.guilds.get(guildid)
+        return None if guild is None else guild.prefix
 
     # Guild server IPs
     async def set_minecraft_server(self, guildid: int, serverip: str):
-        return await self.save(f"guilds/{guildid}/minecraft", serverip)
+        return await self.update_guild(guildid, minecraft=serverip)
 
     async def get_minecraft_server(self, guildid: int):
-        return await self.get(f"guilds/{guildid}/minecraft", 0)
+        return self.minecraft_server(guildid) or 0
+
+    def minecraft_server(self, guildid: int) -> Optional[str]:
+        guild = self._cache.guilds.get(guildid)
+        return None if guild is None else guild.minecraft
 
     # Guild minecraft role
     async def set_minecraft_role(self, guildid: int, roleid: int):
-        return await self.save(f"guilds/{guildid}/role", str(roleid))
+        return await self.update_guild(guildid, role=roleid)
 
     async def get_minecraft_role(self, guildid: int):
-        return await self.get(f"guilds/{guildid}/role", default=0)
+        return self.minecraft_role(guildid) or 0
+
+    def minecraft_role(self, guildid: int) -> Optional[int]:
+        guild = self._cache.guilds.get(guildid)
+        return None if guild is None else guild.role
 
     # Currency
     async def set_user_money(self, userid: int, amount: int):
@@ -162,12 +1962,15 @@ class Database(object):
     async def get_user_money(self, userid: int, *, human_readable=True):
         """`human_readable` specefies if the bot should add in commas every
         three characters, which creates an `str` object instead of an `int`"""
-        d = await self.get(f"users/{userid}/money", default=0)
+        d = self.user_money(userid)
         return f"{d:,}" if human_readable else d
 
-    async def add_user_money(self, userid: int, amount: int):
-        usermoney = await self.get_user_money(userid, human_readable=False)
-        return await self.set_user_money(userid, usermoney + amount)
+    def user_money(self, userid: int) -> int:
+        return self._cache.users.value(userid, "money")
+
+    async def add_user_money(self, userid: int, amount: int) -> int:
+        """Adds `amount` to a user's wallet, returning the new balance"""
+        return await self.increment(f"users/{userid}/money", amount, minimum=0)
     
     async def set_bank_money(self, userid: int, amount: int):
         amount = amount if amount >= 0 else 0
@@ -176,12 +1979,29 @@ class Database(object):
     async def get_bank_money(self, userid: int, *, human_readable=True):
         """`human_readable` specefies if the bot should add in commas every
         three characters, which creates an `str` object instead of an `int`"""
-        d = await self.get(f"users/{userid}/bank", default=0)
+        d = self.bank_money(userid)
         return f"{d:,}" if human_readable else d
 
-    async def add_bank_money(self, userid: int, amount: int):
-        usermoney = await self.get_bank_money(userid, human_readable=False)
-        return await self.set_bank_money(userid, usermoney+amount)
+    def bank_money(self, userid: int) -> int:
+        return self._cache.users.value(userid, "bank")
+
+    async def add_bank_money(self, userid: int, amount: int) -> int:
+        """Adds `amount` to a user's bank, returning the new balance"""
+        return await self.increment(f"users/{userid}/bank", amount, minimum=0)
+
+    async def transfer_user_money(self, senderid: int, receiverid: int, amount: int) -> List[int]:
+        """Moves `amount` from one user's wallet to another's in a single write,
+        returning both new balances. Raises `ValueError` if the sender can't afford it"""
+        return await self.transfer((f"users/{senderid}/money", -amount), (f"users/{receiverid}/money", amount))
+
+    async def deposit_bank_money(self, userid: int, amount: int) -> List[int]:
+        """Moves `amount` from a user's wallet to their bank in a single write,
+        returning the new wallet and bank balances. Raises `ValueError` if they can't afford it"""
+        return await self.transfer((f"users/{userid}/money", -amount), (f"users/{userid}/bank", amount))
+
+    async def withdraw_bank_money(self, userid: int, amount: int) -> List[int]:
+        """The opposite of `deposit_bank_money`"""
+        return await self.deposit_bank_money(userid, -amount)
 
     async def get_leaderboard(self, guild=None, maxusers=10):
         """
@@ -190,29 +2010,20 @@ class Database(object):
             If :param:guild is specified, only users from that guild will be returned.
             If :param:maxusers is specified, the return value will be a max of that
         """
-        users = [int(u) for u in await self.get("users", list()) if u]
-        unsorted = {u:await self.get(f"users/{u}/money", 0) for u in users}
-        filteredmax = sorted(unsorted, key=lambda i:-unsorted[i])
-        
-        # Check if we need to filter max users
-        if maxusers: filteredmax = sorted(unsorted, key=lambda i:-unsorted[i])[:maxusers]
-        srted = {u:unsorted[u] for u in filteredmax}
-        
-        # Returns all users on leaderboard
-        if not guild: return srted
+        if not guild:
+            return self.leaderboard.top(maxusers or None)
+
+        # Members are normally kept up to date by the events cog
+        if not self.leaderboard.has_guild(guild.id):
+            self.leaderboard.set_members(guild.id, [mbr.id for mbr in guild.members if not mbr.bot])
+        return self.leaderboard.top(maxusers or None, guildid=guild.id)
 
-        # Only show users from that guild
-        users_in_guild = [mbr.id for mbr in guild.members if not mbr.bot]
-        return {id_:money for id_,money in srted.items() if id_ in users_in_guild}
+    async def get_user_rank(self, userid: int):
+        """Gets a user's position on the global leaderboard,
+        starting from `1`, or `None` if they have no ingots"""
+        return self.leaderboard.rank(userid)
 
 
-async def get_prefix(bot: commands.Bot, msg: Message):
+def get_prefix(bot: commands.Bot, msg: Message) -> Tuple[str, ...]:
     """Get the prefix from the bot database"""
-    prefixes = [bot.default_prefix]
-
-    if msg.guild:
-        if bot.is_ready() and bot.db.ready:
-            prfx = await bot.db.get_guild_prefix(msg.guild.id)
-            prefixes = [prfx] if prfx != None else prefixes
-    else: prefixes.append("")
-    return commands.when_mentioned_or(*prefixes)(bot, msg)
+    return bot.db.prefixes(bot, msg)
@@ -1,8 +1,10 @@
+from asyncio import sleep
 from datetime import datetime as dt
 
 from discord import AsyncWebhookAdapter, Embed, Guild, Member, Role, Webhook
 from discord.ext import commands
 from cogs.assets.custom import CustomCog
+from cogs.assets.database import BalanceChanged, CacheReloaded
 
 
 class Events(CustomCog):
@@ -24,6 +26,7 @@ class Events(CustomCog):
         self.sess = bot.session
         self.guild_webhook_url = bot.env["GUILD_WEBHOOK_URL"]
         self.commands_webhook_url = bot.env["COMMANDS_WEBHOOK_URL"]
+        self.departed = set() # Users whose data is waiting to be deleted
 
     # Webhook events
     @commands.Cog.listener(name="on_guild_join")
@@ -102,10 +105,10 @@ class Events(CustomCog):
         guild = before.guild
         if not guild or before.bot:
             return
-        if str(guild.id) not in self.db.guild_minecraft_roles.keys():
+        if guild.id not in self.db.guild_minecraft_roles:
             return
 
-        role = guild.get_role(int(self.db.guild_minecraft_roles[str(guild.id)]))
+        role = guild.get_role(self.db.guild_minecraft_roles[guild.id])
         b = [a.name for a in before.activities]
         a = [a.name for a in after.activities]
 
@@ -122,10 +125,50 @@ class Events(CustomCog):
 
     @commands.Cog.listener(name="on_guild_role_delete")
     async def check_minecraft_role_deleted(self, role: Role):
-        if str(role.id) in self.db.guild_minecraft_roles.values():
+        if self.db.minecraft_role_guilds.get(role.id) == role.guild.id:
             await self.db.set_minecraft_role(role.guild.id, None)
             self.logger.debug(f"Deleted the minecraft role for {role.guild.id} ({role.id})")
 
+    # Leaderboard members, only kept for users with money
+    @commands.Cog.listener(name="on_ready")
+    async def load_leaderboard_members(self):
+        for guild in self.bot.guilds:
+            self.db.leaderboard.set_members(guild.id, [m.id for m in guild.members if not m.bot])
+            await sleep(0) # Big bots have a lot of members to look through
+        self.logger.debug(f"Loaded leaderboard members for {len(self.bot.guilds)} guilds")
+
+    @commands.Cog.listener(name="on_cache_reloaded")
+    async def reload_leaderboard_members(self, event: CacheReloaded):
+        await self.load_leaderboard_members() # Anyone's balance could have changed
+
+    @commands.Cog.listener(name="on_balance_changed")
+    async def update_leaderboard_member(self, event: BalanceChanged):
+        if event.account != "money" or bool(event.old) == bool(event.new):
+            return # Still in the same guilds' members
+        for guild in self.bot.guilds:
+            if guild.get_member(event.userid) is None:
+                continue
+            if event.new:
+                self.db.leaderboard.add_member(guild.id, event.userid)
+            else: self.db.leaderboard.remove_member(guild.id, event.userid)
+
+    @commands.Cog.listener(name="on_guild_join")
+    async def add_leaderboard_guild(self, guild: Guild):
+        self.db.leaderboard.set_members(guild.id, [m.id for m in guild.members if not m.bot])
+
+    @commands.Cog.listener(name="on_guild_remove")
+    async def remove_leaderboard_guild(self, guild: Guild):
+        self.db.leaderboard.remove_guild(guild.id)
+
+    @commands.Cog.listener(name="on_member_join")
+    async def add_leaderboard_member(self, member: Member):
+        if not member.bot:
+            self.db.leaderboard.add_member(member.guild.id, member.id)
+
+    @commands.Cog.listener(name="on_member_remove")
+    async def remove_leaderboard_member(self, member: Member):
+        self.db.leaderboard.remove_member(member.guild.id, member.id)
+
     # Thanos snap excess data
     @commands.Cog.listener(name="on_guild_remove")
     async def thanos_snap_guild(self, guild: Guild):
@@ -133,6 +176,18 @@ class Events(CustomCog):
             return # I decided to keep the data
         self.logger.debug(f"Deleting guild data for {guild}")
         await self.db.delete_guild(guild.id)
+
+        # Members the bot can't see anywhere else go too. `get_user` can still find
+        # them for a while after the guild's gone, so the other guilds are checked
+        userids = [m.id for m in guild.members if not m.bot and await self.db.get(f"users/{m.id}") is not None]
+        for other in self.bot.guilds:
+            if other.id != guild.id:
+                userids = [u for u in userids if other.get_member(u) is None]
+            if not userids:
+                return
+            await sleep(0) # There could be a lot of guilds to check
+        self.logger.debug(f"Deleting user data for {len(userids)} members of {guild}")
+        await self.db.delete_users(userids)
     
     @commands.Cog.listener(name="on_member_remove")
     async def thanos_snap_user(self, member: Member):
@@ -141,7 +196,14 @@ class Events(CustomCog):
         if user or member.bot:
             return # Not removed from the bot's scope/no data to delete
         self.logger.debug(f"Deleting user data for {member}")
-        await self.db.delete_user(member.id)
+
+        # A whole guild can leave at once, so everyone leaving around now is deleted together
+        if self.departed:
+            return self.departed.add(member.id)
+        self.departed.add(member.id)
+        await sleep(1)
+        userids, self.departed = [u for u in self.departed if not self.bot.get_user(u)], set()
+        await self.db.delete_users(userids)
 
 
     # Blacklist event
@@ -0,0 +1,353 @@
+"""
+Pings Minecraft servers directly, rather than through a third party API:
+
+    status = await ping("mc.hypixel.net")
+    print(status.edition, status.online, status.max, status.latency)
+
+Three protocols are spoken, and unless one is asked for they're all tried at once
+the first time an address is pinged, remembering which one answered for next time.
+
+- `java`: the Server List Ping used since 1.7. Every packet is framed as a VarInt
+  length followed by a VarInt packet id and the fields. The client sends a handshake
+  asking for the status state, an empty status request, then a ping with a random
+  payload, and the server answers with its status as JSON and echoes the payload back
+- `legacy`: the ping used before 1.7, a single `0xFE 0x01` that's answered by a
+  `0xFF` kick packet holding the status as a UTF-16 string. Servers since 1.7 answer
+  it too, so `java` is preferred when both do
+- `bedrock`: a RakNet unconnected ping over UDP, answered by an unconnected pong
+  holding the status as a `;` separated string. Bedrock servers use port 19132
+
+SRV records aren't looked up, so the address has to point at the server itself.
+"""
+from asyncio import (
+    FIRST_COMPLETED, DatagramProtocol, IncompleteReadError, StreamReader, TimeoutError,
+    ensure_future, get_event_loop, open_connection, wait, wait_for,
+)
+from json import loads
+from random import getrandbits
+from re import compile
+from struct import error as StructError, pack, unpack
+from time import perf_counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+DEFAULT_PORT = 25565
+BEDROCK_PORT = 19132
+PROTOCOL_VERSION = -1 # Servers answer status requests whatever the version, -1 says we don't care which
+MAX_PACKET = 2 ** 21 # Bytes, the most the vanilla server will send in one packet
+FORMATTING = compile(r"§.") # Colour and style codes in server descriptions
+RAKNET_MAGIC = bytes.fromhex("00ffff00fefefefefdfdfdfd12345678") # Marks RakNet's offline messages
+BEDROCK_RESEND = 1 # Seconds between unconnected pings, in case one is lost
+LEGACY_GRACE = 1 # Seconds `java` gets to answer once `legacy` has, since servers that speak both are better off with `java`
+CACHE_SIZE = 10000 # Addresses whose protocol is remembered
+
+
+class PingError(Exception):
+    """The server couldn't be reached, or didn't answer like a Minecraft server"""
+
+
+class Status(NamedTuple):
+    address: str
+    edition: str # The protocol that answered, `java`, `legacy` or `bedrock`
+    latency: float # Milliseconds
+    version: str
+    protocol: int
+    online: int
+    max: int
+    sample: List[str] # The names of some of the players online, if the server shares them
+    description: str # With the formatting taken out
+    favicon: Optional[str] # A `data:image/png;base64,` url
+    raw: dict # The whole status the server sent
+
+
+# Addresses
+def parse_address(address: str, default_port: int=DEFAULT_PORT) -> Tuple[str, int]:
+    """Splits a server address into its lowercase host and port, using `default_port`
+    if it doesn't have one. IPv6 addresses need to be in brackets to have a port"""
+    address = address.strip().lower()
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit() or (":" in host and not host.endswith("]")):
+        host, port = address, default_port # No port, or a bare IPv6 address
+    host = host.rstrip(".")
+    if not host or not 0 < int(port) < 65536:
+        raise PingError(f"Invalid server address {address!r}")
+    return host, int(port)
+
+
+def normalize_address(address: str) -> str:
+    """A server address written the same way however it was given, eg `MC.Hypixel.net`
+    and `mc.hypixel.net:25565` are both `mc.hypixel.net`. The default port is left
+    out rather than filled in, since Bedrock servers default to a different one"""
+    host, port = parse_address(address)
+    return host if port == DEFAULT_PORT else f"{host}:{port}"
+
+
+# Encoding
+def pack_varint(value: int) -> bytes:
+    """7 bits at a time, least significant first, with the top bit set on every byte
+    but the last. Negative numbers are sent as their 32 bit two's complement"""
+    value &= 0xFFFFFFFF
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        data.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(data)
+
+
+def unpack_varint(data: bytes, offset: int=0) -> Tuple[int, int]:
+    """Reads a VarInt from `data`, returning it and the offset after it"""
+    value = 0
+    for i in range(5):
+        if offset + i >= len(data):
+            raise PingError("Packet ended in the middle of a VarInt")
+        byte = data[offset + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return (value - (1 << 32) if value & (1 << 31) else value), offset + i + 1
+    raise PingError("VarInt is too big")
+
+
+async def read_varint(reader: StreamReader) -> int:
+    value = 0
+    for i in range(5):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value - (1 << 32) if value & (1 << 31) else value
+    raise PingError("VarInt is too big")
+
+
+def pack_string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return pack_varint(len(data)) + data
+
+
+def pack_packet(packetid: int, *fields: bytes) -> bytes:
+    body = pack_varint(packetid) + b"".join(fields)
+    return pack_varint(len(body)) + body
+
+
+async def read_packet(reader: StreamReader) -> Tuple[int, bytes]:
+    """Reads a packet, returning its id and the fields after it"""
+    length = await read_varint(reader)
+    if not 0 < length <= MAX_PACKET:
+        raise PingError(f"Bad packet length {length}")
+    body = await reader.readexactly(length)
+    packetid, offset = unpack_varint(body)
+    return packetid, body[offset:]
+
+
+def plain_text(component) -> str:
+    """The text of a chat component, which descriptions can be, without the formatting"""
+    if isinstance(component, str):
+        text = component
+    elif isinstance(component, dict):
+        text = plain_text(component.get("text", "")) + plain_text(component.get("extra", []))
+    elif isinstance(component, list):
+        text = "".join(plain_text(c) for c in component)
+    else: text = ""
+    return FORMATTING.sub("", text)
+
+
+# Pinging
+protocols: Dict[str, str] = dict() # {normalized address: protocol that answered last}
+
+
+async def ping(address: str, *, timeout: float=5, edition: str=None) -> Status:
+    """
+        Gets a server's status, raising `PingError` if it can't within `timeout` seconds.
+        `edition` picks the protocol, otherwise it's the one that answered last time.
+        If there wasn't a last time, or it didn't answer, they're all raced
+    """
+    key = normalize_address(address)
+    edition = edition or protocols.get(key)
+    if edition is not None:
+        try:
+            return await _ping(address, edition, timeout)
+        except PingError:
+            protocols.pop(key, None) # Try them all again next time, in case it changed
+            raise
+
+    status = await race(address, timeout)
+    protocols.pop(key, None)
+    protocols[key] = status.edition
+    if len(protocols) > CACHE_SIZE:
+        del protocols[next(iter(protocols))] # The least recently detected
+    return status
+
+
+async def race(address: str, timeout: float) -> Status:
+    """Pings with every protocol at once, returning the first to answer, except
+    that `java` gets `LEGACY_GRACE` seconds to answer if `legacy` does first"""
+    tasks = {edition: ensure_future(_ping(address, edition, timeout)) for edition in PINGERS}
+    try:
+        pending, errors, legacy = set(tasks.values()), list(), None
+        while pending:
+            done, pending = await wait(pending, timeout=None if legacy is None else LEGACY_GRACE, return_when=FIRST_COMPLETED)
+            if not done: # Grace period is over
+                return legacy
+            for edition, task in tasks.items():
+                if task not in done:
+                    continue
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                elif edition != "legacy":
+                    return task.result()
+                else: legacy = task.result()
+            if legacy is not None and tasks["java"].done():
+                return legacy
+        if legacy is not None:
+            return legacy
+        raise PingError(f"Couldn't ping {address.strip()!r} with any protocol: {'; '.join(map(str, errors))}")
+    finally:
+        for task in tasks.values():
+            task.cancel()
+
+
+async def _ping(address: str, edition: str, timeout: float) -> Status:
+    if edition not in PINGERS:
+        raise PingError(f"Unknown edition {edition!r}, pick from {', '.join(PINGERS)}")
+    host, port = parse_address(address, BEDROCK_PORT if edition == "bedrock" else DEFAULT_PORT)
+    try:
+        return await wait_for(PINGERS[edition](host, port), timeout)
+    except TimeoutError:
+        raise PingError(f"{host}:{port} took more than {timeout}s to answer a {edition} ping") from None
+    except (OSError, IncompleteReadError, UnicodeDecodeError, StructError) as err:
+        raise PingError(f"Couldn't {edition} ping {host}:{port}: {err!r}") from None
+
+
+async def ping_java(host: str, port: int) -> Status:
+    reader, writer = await open_connection(host.strip("[]"), port)
+    try:
+        writer.write(
+            pack_packet(0x00, pack_varint(PROTOCOL_VERSION), pack_string(host), pack("!H", port), pack_varint(1))
+            + pack_packet(0x00)
+        )
+        start = perf_counter()
+        packetid, body = await read_packet(reader)
+        latency = (perf_counter() - start) * 1000
+        if packetid != 0x00:
+            raise PingError(f"Expected a status response, got packet {packetid:#x}")
+        length, offset = unpack_varint(body)
+        try: status = loads(body[offset:offset + length].decode("utf-8"))
+        except ValueError:
+            raise PingError("The status isn't valid JSON") from None
+
+        # Time the ping separately, since building the status can be slow. Some
+        # servers close the connection instead of answering, so that's kept
+        payload = getrandbits(63)
+        writer.write(pack_packet(0x01, pack("!q", payload)))
+        start = perf_counter()
+        try:
+            packetid, body = await read_packet(reader)
+            if packetid == 0x01 and len(body) >= 8 and unpack("!q", body[:8])[0] == payload:
+                latency = (perf_counter() - start) * 1000
+        except (OSError, IncompleteReadError):
+            pass
+    finally:
+        writer.close()
+
+    if not isinstance(status, dict):
+        raise PingError("The status isn't a JSON object")
+    players = _field(status, "players", dict, dict())
+    version = _field(status, "version", dict, dict())
+    return Status(
+        address=f"{host}:{port}", edition="java", latency=latency,
+        version=plain_text(version.get("name", "")), protocol=_field(version, "protocol", int, 0),
+        online=_field(players, "online", int, 0), max=_field(players, "max", int, 0),
+        sample=[_field(p, "name", str, "") for p in _field(players, "sample", list, list()) if isinstance(p, dict)],
+        description=plain_text(status.get("description", "")), favicon=_field(status, "favicon", str, None), raw=status,
+    )
+
+
+def _field(obj: dict, key: str, kind: type, default):
+    """`obj[key]` if it's a `kind`, otherwise `default`, since servers can send anything"""
+    value = obj.get(key, default)
+    return value if isinstance(value, kind) else default
+
+
+async def ping_legacy(host: str, port: int) -> Status:
+    reader, writer = await open_connection(host.strip("[]"), port)
+    try:
+        writer.write(b"\xfe\x01")
+        start = perf_counter()
+        packetid, length = unpack("!BH", await reader.readexactly(3))
+        latency = (perf_counter() - start) * 1000
+        if packetid != 0xFF:
+            raise PingError(f"Expected a kick packet, got packet {packetid:#x}")
+        text = (await reader.readexactly(length * 2)).decode("utf-16-be")
+    finally:
+        writer.close()
+
+    # 1.4 onwards: "§1", protocol, version, motd, online, max. Before that: motd§online§max
+    try:
+        if text.startswith("§1\x00"):
+            _, protocol, version, motd, online, maxplayers = text.split("\x00")
+            protocol = int(protocol)
+        else:
+            motd, online, maxplayers = text.rsplit("§", 2)
+            protocol, version = 0, ""
+        online, maxplayers = int(online), int(maxplayers)
+    except ValueError:
+        raise PingError(f"Couldn't read the legacy status {text!r}") from None
+    return Status(
+        address=f"{host}:{port}", edition="legacy", latency=latency, version=version, protocol=protocol,
+        online=online, max=maxplayers, sample=list(), description=plain_text(motd), favicon=None,
+        raw=dict(version=version, protocol=protocol, motd=motd, online=online, max=maxplayers),
+    )
+
+
+class _BedrockPinger(DatagramProtocol):
+    """Resolves `pong` with the first unconnected pong received, and when it was sent"""
+
+    def __init__(self):
+        self.pong = get_event_loop().create_future()
+        self.sent = dict() # {time field: when it was sent}
+
+    def datagram_received(self, data: bytes, addr):
+        if self.pong.done() or len(data) < 35 or data[0] != 0x1C or data[17:33] != RAKNET_MAGIC:
+            return
+        sent = self.sent.get(unpack("!q", data[1:9])[0])
+        if sent is not None:
+            self.pong.set_result(((perf_counter() - sent) * 1000, data))
+
+    def error_received(self, exc: Exception):
+        if not self.pong.done():
+            self.pong.set_exception(exc)
+
+
+async def ping_bedrock(host: str, port: int) -> Status:
+    transport, pinger = await get_event_loop().create_datagram_endpoint(_BedrockPinger, remote_addr=(host.strip("[]"), port))
+    try:
+        guid = getrandbits(63)
+        while not pinger.pong.done():
+            sent = len(pinger.sent)
+            pinger.sent[sent] = perf_counter()
+            transport.sendto(pack("!Bq", 0x01, sent) + RAKNET_MAGIC + pack("!q", guid))
+            await wait([pinger.pong], timeout=BEDROCK_RESEND)
+        latency, data = pinger.pong.result()
+    finally:
+        transport.close()
+
+    # 0x1C, time, server guid, magic, then the status as a string with a 16 bit length
+    length = unpack("!H", data[33:35])[0]
+    fields = data[35:35 + length].decode("utf-8").split(";")
+    try:
+        _, motd, protocol, version, online, maxplayers = fields[:6]
+        online, maxplayers, protocol = int(online), int(maxplayers), int(protocol)
+    except ValueError:
+        raise PingError(f"Couldn't read the bedrock status {fields!r}") from None
+    motd2 = fields[7] if len(fields) > 7 else ""
+    return Status(
+        address=f"{host}:{port}", edition="bedrock", latency=latency, version=version, protocol=protocol,
+        online=online, max=maxplayers, sample=list(),
+        description=plain_text("\n".join(filter(None, [motd, motd2]))), favicon=None,
+        raw=dict(
+            edition=fields[0], motd=motd, protocol=protocol, version=version, online=online, max=maxplayers,
+            serverid=fields[6] if len(fields) > 6 else "", motd2=motd2, gamemode=fields[8] if len(fields) > 8 else "",
+        ),
+    )
+
+
+PINGERS = dict(java=ping_java, legacy=ping_legacy, bedrock=ping_bedrock) # In order of preference
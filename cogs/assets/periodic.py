@@ -1,8 +1,14 @@
-from typing import Set
+from asyncio import Event, Queue, Semaphore, TimeoutError, ensure_future, gather, sleep, wait_for
+from heapq import heappop, heappush
+from logging import getLogger
+from random import uniform
+from time import monotonic
+from typing import Dict, List
 
-from discord import Guild
+from discord import Guild, HTTPException
 from discord.ext import commands, tasks
 from cogs.assets.custom import CustomCog
+from cogs.assets.mcping import PingError, Status, normalize_address, parse_address, ping
 
 # The number of seconds to wait
 # if the last ping was successful
@@ -10,120 +16,380 @@ ONLINE = 60 * 10
 # The number of seconds to wait
 # if the last ping was unsuccessful
 OFFLINE = 60 * 25
+# The number of seconds between full
+# re-downloads of the database cache
+RECONCILE = 60 * 15
+# The fraction of each wait that's randomly
+# added or taken away, so pings drift apart
+JITTER = 0.1
+# The number of seconds the first pings
+# are spread over after starting up
+STARTUP_SPREAD = 60
+# The number of checks run at once, each
+# waiting for the executor to send its ping
+WORKERS = 64
+# The most pings that can be sent at once,
+# reached gradually after starting up
+PING_CONCURRENCY = 32
+# The number of seconds it takes to
+# get up to PING_CONCURRENCY
+RAMP_UP = 60
+# The pings a second each host gets, and how
+# many can be sent at once after it's been quiet
+HOST_RATE = 1
+HOST_BURST = 3
+# The number of seconds each attempt at a ping gets,
+# the number of attempts, and the wait between them
+PING_TIMEOUT = 5
+ATTEMPTS = 2
+RETRY_DELAY = 5
+# The number of hosts to keep rate limits for,
+# before forgetting the ones that have been quiet
+MAX_HOSTS = 10000
+
+
+class PingScheduler(object):
+    """
+        Calls `ping(key)` whenever a key is due, with at most `workers` running at
+        once. Due times are kept in a min-heap, and a single task sleeps until the
+        earliest one, so nothing wakes up for keys that aren't due yet. `ping`
+        returns the number of seconds until the key is due again, which has some
+        jitter added, or `None` to stop pinging it
+    """
+
+    def __init__(self, ping, *, workers: int=WORKERS, jitter: float=JITTER):
+        self.ping = ping
+        self.workers = workers
+        self.jitter = jitter
+        self.logger = getLogger("bot.pinger")
+
+        self.due = dict() # {key: due time}
+        self._heap = list() # [(due time, key)], with stale entries for keys that were moved or cancelled
+        self._ready = Queue() # Keys that are due, waiting for a worker
+        self._wakeup = Event()
+        self._tasks = list()
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def __contains__(self, key) -> bool:
+        return key in self.due
+
+    @property
+    def backlog(self) -> int:
+        """The number of keys that are due, but waiting for a worker"""
+        return self._ready.qsize()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [ensure_future(self._run())] + [ensure_future(self._work()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+
+    def schedule(self, key, delay: float):
+        """Pings `key` in `delay` seconds, instead of whenever it was due"""
+        due = self.due[key] = monotonic() + delay
+        heappush(self._heap, (due, key))
+        if self._heap[0][0] == due:
+            self._wakeup.set() # Sooner than whatever was being waited for
+
+    def cancel(self, key):
+        """Stops pinging `key`. A ping that's already running still finishes"""
+        self.due.pop(key, None)
+
+    async def _run(self):
+        while True:
+            while self._heap and self.due.get(self._heap[0][1]) != self._heap[0][0]:
+                heappop(self._heap) # Stale
+            timeout = self._heap[0][0] - monotonic() if self._heap else None
+            if timeout is not None and timeout <= 0:
+                key = heappop(self._heap)[1]
+                del self.due[key]
+                self._ready.put_nowait(key)
+                continue
+
+            self._wakeup.clear()
+            try: await wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError: pass
+
+    async def _work(self):
+        while True:
+            key = await self._ready.get()
+            try: delay = await self.ping(key)
+            except Exception:
+                self.logger.exception(f"Failed to ping {key!r}")
+                delay = OFFLINE
+            if delay is not None and key not in self.due: # Unless it was rescheduled meanwhile
+                self.schedule(key, delay * uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class TokenBucket(object):
+    """Lets `rate` things through a second on average, and up to `burst` at once.
+    Tokens are handed out in the order they're asked for, each waiting for its own"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        self._refill()
+        self.tokens -= 1 # Goes negative while there's a queue
+        if self.tokens < 0:
+            await sleep(-self.tokens / self.rate)
+
+
+class PingExecutor(object):
+    """
+        Sends pings with at most `concurrency` at once, and at most `rate` a second to
+        any one host, or `burst` at once after it's been quiet. Each attempt gets
+        `timeout` seconds, and pings that fail are tried `attempts` times. The number
+        sent at once starts at 1 and rises to `concurrency` over `ramp` seconds, so a
+        restart doesn't send every ping at once, and no host sees a flood of them
+    """
+
+    def __init__(self, *, concurrency: int=PING_CONCURRENCY, rate: float=HOST_RATE, burst: int=HOST_BURST,
+                 timeout: float=PING_TIMEOUT, attempts: int=ATTEMPTS, ramp: float=RAMP_UP):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.attempts = attempts
+        self.ramp = ramp
+
+        # Gauges
+        self.queued = 0 # Pings waiting for their host, or for a free slot
+        self.inflight = 0
+        self.sent = 0
+        self.failed = 0
+
+        self.capacity = 1 if ramp else concurrency
+        self._slots = Semaphore(self.capacity)
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._ramp = None
+
+    @property
+    def gauges(self) -> dict:
+        return dict(
+            queued=self.queued, inflight=self.inflight, capacity=self.capacity,
+            sent=self.sent, failed=self.failed, hosts=len(self._buckets),
+        )
+
+    def start(self):
+        if self._ramp is None and self.capacity < self.concurrency:
+            self._ramp = ensure_future(self._ramp_up())
+
+    def stop(self):
+        if self._ramp is not None:
+            self._ramp.cancel()
+
+    async def _ramp_up(self):
+        while self.capacity < self.concurrency:
+            await sleep(self.ramp / (self.concurrency - 1))
+            self.capacity += 1
+            self._slots.release()
+
+    def _bucket(self, host: str) -> TokenBucket:
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if len(self._buckets) >= MAX_HOSTS:
+                self._buckets = {h: b for h, b in self._buckets.items() if not b.full}
+            bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def ping(self, address: str) -> Status:
+        """Pings a server when its host and a slot are free, raising
+        the last `PingError` if none of the attempts work"""
+        host = parse_address(address)[0]
+        for attempt in range(self.attempts):
+            if attempt:
+                await sleep(RETRY_DELAY * 2 ** (attempt - 1))
+            self.queued += 1
+            try:
+                await self._bucket(host).take()
+                await self._slots.acquire()
+            finally:
+                self.queued -= 1
+
+            self.inflight += 1
+            self.sent += 1
+            try:
+                return await ping(address, timeout=self.timeout)
+            except PingError as err:
+                self.failed += 1
+                error = err
+            finally:
+                self.inflight -= 1
+                self._slots.release()
+        raise error
 
 
 class Checker(object):
     # TODO: Add a `self.history` thingo for advanced ping detection
-    # TODO: This breaks itself when unloading the cog
-    """The object that controls all of the handling for the
-    pinging of each individual server (multiple instances)"""
+    """Handles the pinging of a server, showing the result in the
+    bot's nickname in every guild that's set to that server"""
 
-    def __init__(self, bot: commands.Bot, guildid: int, serverip: str):
+    def __init__(self, bot: commands.Bot, address: str, executor: PingExecutor):
         self.bot = bot
-        self.ip = serverip
-        self.guildid = guildid
+        self.address = address
+        self.executor = executor
+        self.guildids = set()
         self.history: List[bool] = list()
 
-        self.guild: Guild
-        self.result: str
+        self.result: str = None
         self.online = False
-        # ^^ Checks if online has changed since last iteration
-        self.sess = bot.session
-        self.tsk.start()
 
     # Main function
-    @tasks.loop(seconds=ONLINE)
-    async def tsk(self):
-        """Pings the server and updates the info"""
-        print(f"checking {self.guild.id} {self.ip!r}")
+    async def check(self) -> int:
+        """Pings the server and updates the info,
+        returning the seconds until the next check"""
+        guilds = [g for g in map(self.bot.get_guild, self.guildids) if g is not None]
+        if not guilds:
+            return OFFLINE # Unavailable for now
 
         # Fetch the stats
-        async with self.sess.get(f"https://api.minetools.eu/ping/{self.ip}") as resp:
-            data = await resp.json()
-            data.pop("favicon")
-
-        # Sort the data
-        ping = 5 * round(data["latency"] / 5)
-        players = data["players"]["online"]
-        maxplayers = data["players"]["max"]
-        online = f"{players}/{maxplayers} plyrs - {ping}ms ping"
-        result = online if ping > 5 else "OFFLINE"
-        online = result != "OFFLINE"
+        try: status = await self.executor.ping(self.address)
+        except PingError:
+            status = None
 
         # Update class variables
-        self.result = result
-        self.online_changed = self.online != online
-        self.online = online
-        await self.guild.me.edit(nick=result)
-
-    # Extra functions
-    @tsk.before_loop
-    async def before_task(self):
-        """Make sure the cache is ready"""
-        await self.bot.wait_until_ready()
-        self.guild = self.bot.get_guild(self.guildid)
+        self.online = status is not None
+        self.result = f"{status.online}/{status.max} plyrs - {5 * round(status.latency / 5)}ms ping" if status else "OFFLINE"
+        await gather(*[self.show(guild) for guild in guilds])
+        return ONLINE if self.online else OFFLINE
 
-    @tsk.after_loop
-    async def after_task(self):
-        """Update the wait time, if needed"""
-        if not self.online_changed:
-            return
-        if self.online:
-            self.tsk.change_interval(seconds=ONLINE)
-        else:
-            self.tsk.change_interval(seconds=OFFLINE)
+    async def show(self, guild: Guild):
+        """Puts the last result in the bot's nickname in `guild`"""
+        try: await guild.me.edit(nick=self.result)
+        except HTTPException as err:
+            getLogger("bot.pinger").debug(f"Couldn't update the nickname in {guild.id}: {err!r}")
 
 
 class ServerStatus(CustomCog):
-    # TODO: What happens when someone changes the IP while the bot is still pinging hmm?
-    # TODO rewrite this lulul
-    """The cog that handles all the server pinging"""
+    """The cog that handles all the server pinging. Each server is pinged once
+    for every guild that's set to it, by the same scheduler, rather than a
+    task for each guild"""
 
     def __init__(self, bot: commands.Bot):
         super().__init__(self)
         self.bot = bot
         self.db = bot.db
-        self.tasks: Set[Checker] = set()
+        self.tasks: Dict[str, Checker] = dict() # {address: Checker}
+        self.addresses: Dict[int, str] = dict() # {guildid: address}
+        self.scheduler = PingScheduler(self.check)
+        self.executor = PingExecutor()
+
+    @property
+    def gauges(self) -> dict:
+        """How many servers are being pinged, how many checks are due but waiting for
+        a worker, and the executor's queued and in-flight pings"""
+        return dict(servers=len(self.scheduler), backlog=self.scheduler.backlog, **self.executor.gauges)
     
     @commands.Cog.listener()
     async def on_ready(self):
         while not self.db.ready:
-            pass
-        if self.tasks != set():
+            await sleep(1)
+        self.executor.start()
+        self.scheduler.start()
+        if self.tasks:
             return # Tasks already loaded
         
         self.logger.debug(f"{self.__class__.__name__!r} cog ready, loading checkers")
         for guildid, serverip in self.db.guild_server_ips.items():
-            self.create_task(int(guildid), serverip)
-        self.logger.debug("Finished loading checkers")
+            self.create_task(guildid, serverip, delay=uniform(0, STARTUP_SPREAD))
+        self.logger.debug(f"Finished loading checkers for {len(self.tasks)} servers")
+
+    @commands.Cog.listener()
+    async def on_guild_setting_changed(self, event):
+        """Restart a guild's checker as soon as its server IP changes"""
+        if event.setting == "minecraft" and self.bot.is_ready():
+            self.reload_task(event.guildid)
 
     def cog_unload(self):
         """Finish & close all pingers"""
-        [task.tsk.stop() for task in self.tasks]
-        self.logger.debug(f"Closed {len(self.tasks)} tasks while unloading cog {self.__class__.__name__!r}")
+        self.scheduler.stop()
+        self.executor.stop()
+        self.logger.debug(f"Closed {len(self.tasks)} tasks while unloading cog {self.__class__.__name__!r}, {self.gauges}")
+
+    async def check(self, address: str):
+        checker = self.tasks.get(address)
+        return None if checker is None else await checker.check()
 
-    def create_task(self, guildid: int, serverip: str):
-        """Creates a task"""
-        tsk = Checker(self.bot, guildid, serverip)
-        self.tasks.add(tsk)
+    def create_task(self, guildid: int, serverip: str, *, delay: float=0):
+        """Adds a guild to its server's checker, creating it to ping in `delay`
+        seconds if it's the first guild there"""
+        try: address = normalize_address(serverip)
+        except PingError:
+            return self.logger.debug(f"Not pinging {serverip!r} for guild {guildid}, it isn't a server address")
+        self.addresses[guildid] = address
+        tsk = self.tasks.get(address)
+        if tsk is None:
+            tsk = self.tasks[address] = Checker(self.bot, address, self.executor)
+            self.scheduler.schedule(address, delay)
+        elif tsk.result is not None and self.bot.get_guild(guildid):
+            ensure_future(tsk.show(self.bot.get_guild(guildid))) # Already pinged recently
+        tsk.guildids.add(guildid)
         return tsk
     
     def stop_task(self, guildid: int):
-        """Stop a particular task that a guild is running"""
-        task = [t for t in self.tasks if t.guildid == guildid]
-        task = task[0] if task else None
-        if not task:
-            print(f"No task found by Guild ID {guildid!r}")
-        print(f"Closing task {task}")
-        task.tsk.stop()
+        """Stop pinging a guild's server, unless other guilds use it too"""
+        address = self.addresses.pop(guildid, None)
+        if address is None:
+            return self.logger.debug(f"No task found by Guild ID {guildid!r}")
+        task = self.tasks[address]
+        task.guildids.discard(guildid)
+        if not task.guildids:
+            del self.tasks[address]
+            self.scheduler.cancel(address)
     
     def reload_task(self, guildid: int):
         """Reload a task, updating the data to ping"""
-        # TODO: Make this lol
-        ip = self.db.guild_server_ips.get(str(guildid))
-        self.stop_task(guildid)
-        self.create_task(guildid, ip)
+        ip = self.db.guild_server_ips.get(guildid)
+        if guildid in self.addresses:
+            self.stop_task(guildid)
+        if ip: self.create_task(guildid, ip)
+
+
+class CacheReconciler(CustomCog):
+    """Writes are applied to the database cache locally, so every
+    so often the whole thing is re-downloaded to pick up anything
+    that was changed outside of the bot"""
+
+    def __init__(self, bot: commands.Bot):
+        super().__init__(self)
+        self.bot = bot
+        self.db = bot.db
+        self.reconcile.start()
+
+    def cog_unload(self):
+        self.reconcile.cancel()
+
+    @tasks.loop(seconds=RECONCILE)
+    async def reconcile(self):
+        await self.db.update_cache()
+        self.logger.debug("Reconciled the database cache with the remote host")
+
+    @reconcile.before_loop
+    async def before_reconcile(self):
+        """The cache is already fresh on startup"""
+        await self.bot.wait_until_ready()
+        await sleep(RECONCILE)
 
 
 def setup(bot: commands.Bot):
     bot.add_cog(ServerStatus(bot))
+    bot.add_cog(CacheReconciler(bot))
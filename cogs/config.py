@@ -60,7 +60,7 @@ class Config(CustomCog):
         if prefix in ["", self.bot.default_prefix]:
             embed.description = f"Prefix returned to the default (`{self.bot.default_prefix}`)"
             await ctx.send(embed=embed)
-            return await self.db.set_guild_prefix(ctx.guild.id, None)
+            return await self.db.update_guild(ctx.guild.id, prefix=None)
 
         if len(prefix) > 15:
             embed.description = "Prefix must be a maximum of `15` characters"
@@ -68,7 +68,7 @@ class Config(CustomCog):
 
         embed.description = f"Success! Prefix is now `{prefix}` :thumbsup:"
         await ctx.send(embed=embed)
-        await self.db.set_guild_prefix(ctx.guild.id, prefix)
+        await self.db.update_guild(ctx.guild.id, prefix=prefix)
 
     @commands.command(name="setserver", aliases=["mcserver", "mcserverip"])
     @cooldown(3, 60, 4, 45, commands.BucketType.guild)
@@ -91,7 +91,7 @@ class Config(CustomCog):
         if ip in ["", "reset"]:
             embed.description = "Server IP has been cleared"
             await ctx.send(embed=embed)
-            return await self.db.set_minecraft_server(ctx.guild.id, None)
+            return await self.db.update_guild(ctx.guild.id, minecraft=None)
 
         if len(ip) > 35:
             embed.description = "Server IP must be a maximum of `35` characters"
@@ -99,7 +99,7 @@ class Config(CustomCog):
 
         embed.description = f"Success! Server IP is now `{ip}` :thumbsup:"
         await ctx.send(embed=embed)
-        await self.db.set_minecraft_server(ctx.guild.id, ip)
+        await self.db.update_guild(ctx.guild.id, minecraft=ip)
 
     @commands.command(name="autorole", aliases=["minecraftrole", "mcrole", "role"])
     @cooldown(3, 60, 4, 45, commands.BucketType.guild)
@@ -118,7 +118,7 @@ class Config(CustomCog):
         if role in ["", "reset"]:
             embed.description = "Minecraft role has been cleared"
             await ctx.send(embed=embed)
-            return await self.db.set_minecraft_role(ctx.guild.id, None)
+            return await self.db.update_guild(ctx.guild.id, role=None)
 
         if role == None:
             roleid = await self.db.get_minecraft_role(ctx.guild.id)
@@ -143,7 +143,7 @@ class Config(CustomCog):
 
         embed.description = f"Success! Minecraft role is now {role.mention} :thumbsup:"
         await ctx.send(embed=embed)
-        await self.db.set_minecraft_role(ctx.guild.id, role.id)
+        await self.db.update_guild(ctx.guild.id, role=role.id)
 
 
 def setup(bot: commands.Bot):
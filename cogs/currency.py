@@ -83,9 +83,10 @@ class Currency(CustomCog):
         if member.bot:
             return await ctx.send("Trying to give bots ingots? 🤔")
         
+        try: await self.db.transfer_user_money(ctx.author.id, member.id, amount)
+        except ValueError:
+            return await ctx.send(f"You don't have **{amount} {self.bot.ingot}** to give 🤷")
         await ctx.send(f"Congrats, you just wasted a hard earned **{amount} {self.bot.ingot}**")
-        await self.db.add_user_money(ctx.author.id, -amount)
-        await self.db.add_user_money(member.id, amount)
 
     @commands.command()
     @commands.guild_only()
@@ -116,22 +117,22 @@ class Currency(CustomCog):
 
         if won:
             amount = randint(round(vtm/8), round(vtm/3))
+            try: await self.db.transfer_user_money(victim.id, ctx.author.id, amount)
+            except ValueError: # Spent it while we weren't looking
+                return await ctx.send(f"Not worth it, **{victim}** only has **{await self.db.get_user_money(victim.id)} {self.bot.ingot}**")
             await ctx.send(f"Wow congrats **{ctx.author}**! You managed to steal **{amount} {self.bot.ingot}** from **{victim}**")
             
             try: await victim.send(f"Massive 🇫 **{ctx.author}** just stole **{amount} {self.bot.ingot}** from you in `{ctx.guild}` 😕")
             except: pass
-
-            await self.db.add_user_money(ctx.author.id, amount)
-            await self.db.add_user_money(victim.id, -amount)
             return
 
         amount = randint(round(you/8), round(you/3))
+        try: await self.db.transfer_user_money(ctx.author.id, victim.id, amount)
+        except ValueError:
+            return await ctx.send(f"You must have at least **150 {self.bot.ingot}** to steal from someone 🤷")
         msg = await ctx.send(f"Massive 🇫 for **{ctx.author}** who tried (and failed) steal from **{victim}** and had to pay them **{amount} {self.bot.ingot}**")
         await ctx.react(msg, "🇫")
 
-        await self.db.add_user_money(ctx.author.id, -amount)
-        await self.db.add_user_money(victim.id, amount)
-
     @commands.command()
     @cooldown(8, 90, 20, 90)
     async def flip(self, ctx, headsortails: str = ""):
@@ -286,9 +287,10 @@ class Currency(CustomCog):
         if bank > (capacity*bal)/100:
             return await ctx.send("Your bank is full!")
         
-        await ctx.send(f"Done! Your wallet balance is now `{bal-amount}` ingots and your bank holds `{bank+amount}`")
-        await self.db.add_bank_money(ctx.author.id, amount)
-        await self.db.add_user_money(ctx.author.id, -amount)
+        try: bal, bank = await self.db.deposit_bank_money(ctx.author.id, amount)
+        except ValueError:
+            return await ctx.send("You don't have that many ingots in your wallet!")
+        await ctx.send(f"Done! Your wallet balance is now `{bal}` ingots and your bank holds `{bank}`")
 
     @bank.command(aliases=["with"])
     async def withdraw(self, ctx, amount: int):
@@ -297,9 +299,10 @@ class Currency(CustomCog):
         bank = await self.db.get_bank_money(ctx.author.id, human_readable=False)
         amount = min([amount, bank])
 
+        try: await self.db.withdraw_bank_money(ctx.author.id, amount)
+        except ValueError:
+            return await ctx.send("You don't have that many ingots in your bank!")
         await ctx.send(f"Withdrew `{amount}` ingots 👍")
-        await self.db.add_user_money(ctx.author.id, amount)
-        await self.db.add_bank_money(ctx.author.id, -amount)
 
 
 class AdminCurrency(CustomCog):
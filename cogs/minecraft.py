@@ -1,11 +1,14 @@
+from base64 import b64decode
+from binascii import Error as BinasciiError
 from datetime import datetime as dt
-from re import sub
+from io import BytesIO
 from time import ctime, time
 
-from discord import Colour, Embed
+from discord import Colour, Embed, File
 from discord.ext import commands
 from humanize import naturaltime
 from cogs.assets.custom import CustomCog, MinecraftUser, cooldown
+from cogs.assets.mcping import PingError, ping
 
 
 class Minecraft(CustomCog):
@@ -29,34 +32,33 @@ class Minecraft(CustomCog):
         await ctx.trigger_typing()
         e = Embed(title=server, colour=Colour.blue(), timestamp=ctx.message.created_at)
 
-        async with self.sess.get(f"https://api.minetools.eu/ping/{server}") as resp:
-            try:
-                response = await resp.json()
-                error = response.get("error")
-                players = response["players"]
-            except Exception:
-                error = "[ERROR] Invalid IP"
-
-        if error:
+        try: status = await ping(server)
+        except PingError as err:
             e.colour = Colour.red()
             e.title = "Error pinging server"
-            e.description = error
+            e.description = str(err)
             return await ctx.send(embed=e)
 
         fields = {
-            "Ping :ping_pong:": str(round(response["latency"], 2)) + "ms",
-            "Version :desktop:": response["version"]["name"],
-            "Player count :busts_in_silhouette:": f"{players['online']}/{players['max']}"
+            "Ping :ping_pong:": f"{round(status.latency, 2)}ms",
+            "Version :desktop:": f"{status.version} ({status.edition.title()})",
+            "Player count :busts_in_silhouette:": f"{status.online}/{status.max}"
         }
-        if players["sample"]:
-            fields["Players :video_game:"] = f"`{'`, `'.join([p['name'] for p in players['sample']])}`"
+        if status.sample:
+            fields["Players :video_game:"] = f"`{'`, `'.join(status.sample)}`"
 
         for field in fields:
             e.add_field(name=field, value=fields[field])
-        e.description = sub("§[a-zA-z0-9]", "", response["description"])
+        e.description = status.description
         e.set_footer(text=f"Server pinged in {round((time()-ctx.message.created_at.timestamp())*1000)}ms", icon_url=self.bot.user.avatar_url)
-        e.set_thumbnail(url=f"https://api.minetools.eu/favicon/{server}")
-        await ctx.send(embed=e)
+
+        # The favicon comes as a data url, so it has to be uploaded with the embed
+        favicon = None
+        if (status.favicon or "").startswith("data:image/png;base64,"):
+            try: favicon = File(BytesIO(b64decode(status.favicon.split(",", 1)[1])), filename="favicon.png")
+            except BinasciiError: pass
+            else: e.set_thumbnail(url="attachment://favicon.png")
+        await ctx.send(embed=e, file=favicon)
 
     @commands.command(aliases=["user", "profile"])
     @cooldown(2, 12, 3, 8, commands.BucketType.user)
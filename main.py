@@ -56,6 +56,7 @@ async def on_ready():
     if hasattr(bot, "ready_time"):
         return
     bot.ready_time = dt.utcnow()
+    bot.db.prefixes.configure(userid=bot.user.id)
     bot.logger.info("Bot ready - {0.name!r} ({0.id}). Loaded in {1}".format(bot.user, bot.uptime))
 
     # Update env on site
@@ -86,7 +87,9 @@ async def on_ready():
 
 @bot.event
 async def on_connect():
-    await bot.db.update_cache()
+    await bot.db.sync()
+    if bot.env.get("DATABASE_LISTEN", "False").upper() == "TRUE":
+        bot.db.listen() # Only starts once, however often we reconnect
 
     bot.logger.info(f"Bot reconnected at {dt.now():%H:%M:%S}")
     bot.logger.info("Database ready")
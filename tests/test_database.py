@@ -0,0 +1,374 @@
+from asyncio import Event, ensure_future, gather, run, sleep, wait_for
+from random import Random
+
+import pytest
+from aiohttp import web
+
+from benchmarks.fakestore import FakeStore
+from cogs.assets.database import (
+    Database, JSONStreamLoader, Leaderboard, SQLiteBackend, UserRecord, UserTable, WriteRejected,
+)
+
+
+async def connect(store: FakeStore) -> Database:
+    db = await Database.create(store.url)
+    db.FLUSH_DELAY = 0.01
+    return db
+
+
+def test_stream_loader_splits_anywhere():
+    """Records come out the same wherever the chunks split, even in the middle of a number"""
+    document = b'{"result":{"users":{"1":1.5e10,"2":-0.25E+3,"3":{"money":7},"4":"a\\"b"},"other":[1,2]}}'
+    def load(*chunks):
+        records = list()
+        loader = JSONStreamLoader(lambda path, value: records.append((path, value)), depth=3)
+        for chunk in chunks:
+            loader.feed(chunk)
+        loader.close()
+        return records
+
+    users = ("result", "users")
+    assert load(document) == [
+        (users + ("1",), 1.5e10), (users + ("2",), -250.0), (users + ("3",), {"money": 7}),
+        (users + ("4",), 'a"b'), (("result", "other"), [1, 2]),
+    ]
+    for split in range(len(document)):
+        assert load(document[:split], document[split:]) == load(document), split
+
+
+def wallet(money: int) -> UserRecord:
+    record = UserRecord()
+    record.money = money or None
+    return record
+
+
+def test_leaderboard_follows_the_table(monkeypatch):
+    monkeypatch.setattr(Leaderboard, "BLOCK", 4) # So blocks get split and emptied
+    rng, users = Random(3), UserTable()
+    for userid in range(1, 40):
+        users[userid] = wallet(rng.choice([0, rng.randint(-5, 20)]))
+    leaderboard = Leaderboard(users)
+    leaderboard.load(users)
+    leaderboard.set_members(1, range(1, 40, 3))
+
+    for _ in range(500):
+        userid = rng.randint(1, 60)
+        old = users.value(userid, "money")
+        users[userid] = wallet(rng.choice([0, old + rng.randint(-10, 10), rng.randint(-5, 20)]))
+        leaderboard.update(userid, old)
+        if userid % 3 == 1 and userid < 40: # Kept in step the way the events cog does
+            leaderboard.add_member(1, userid)
+            if not users.value(userid, "money"): leaderboard.remove_member(1, userid)
+
+        expected = sorted(users.ids, key=lambda u: (-users.value(u, "money"), u))
+        expected = [u for u in expected if users.value(u, "money")]
+        assert list(leaderboard) == expected and len(leaderboard) == len(expected)
+        assert leaderboard.rank(userid) == (expected.index(userid) + 1 if userid in expected else None)
+        assert list(leaderboard.top(5)) == expected[:5]
+        assert list(leaderboard.top(3, guildid=1)) == [u for u in expected if u < 40 and u % 3 == 1][:3]
+
+
+def test_leaderboard_only_keeps_members_with_money():
+    users = UserTable()
+    users[1], users[2] = wallet(5), wallet(0)
+    leaderboard = Leaderboard(users)
+    leaderboard.load(users)
+
+    leaderboard.add_member(7, 1) # Nothing's known about the guild yet
+    assert not leaderboard.has_guild(7)
+    leaderboard.set_members(7, [1, 2, 3])
+    assert leaderboard._members[7] == {1}
+    users[3] = wallet(9)
+    leaderboard.update(3, 0)
+    leaderboard.add_member(7, 3)
+    leaderboard.add_member(7, 2)
+    assert leaderboard.top(guildid=7) == {3: 9, 1: 5}
+
+
+def test_concurrent_increments_from_two_databases():
+    """Hundreds of increments to the same few users, half through each database,
+    all make it to the store however they end up batched"""
+    async def main():
+        async with FakeStore({"users": {"1": {"money": 100}}}) as store:
+            a, b = await connect(store), await connect(store)
+            rng = Random(7)
+            amounts = [(rng.randint(1, 10), rng.randint(1, 50)) for _ in range(400)]
+            await gather(*[
+                (a if i % 2 else b).add_user_money(userid, amount)
+                for i, (userid, amount) in enumerate(amounts)
+            ])
+            assert await a.flush() and await b.flush()
+
+            stored = store.data["users"]
+            assert sum(user.get("money", 0) for user in stored.values()) == 100 + sum(amount for _, amount in amounts)
+            for userid in range(1, 11):
+                expected = (userid == 1) * 100 + sum(amount for u, amount in amounts if u == userid)
+                assert stored.get(str(userid), {}).get("money", 0) == expected, userid
+            await a.close()
+            await b.close()
+    run(main())
+
+
+def test_concurrent_increments_and_transfers():
+    """Two databases sharing a store, each adding and moving money around at once,
+    end up agreeing with the store, and transfers never create or destroy any"""
+    users = 20
+    async def main():
+        data = {"users": {str(u): {"money": 1000} for u in range(1, users + 1)}}
+        async with FakeStore(data) as store:
+            a, b = await connect(store), await connect(store)
+
+            async def work(db: Database, seed: int):
+                rng = Random(seed)
+                for _ in range(200):
+                    sender, receiver = rng.sample(range(1, users + 1), 2)
+                    try:
+                        await db.transfer_user_money(sender, receiver, rng.randint(1, 50))
+                        await db.deposit_bank_money(receiver, rng.randint(1, 10))
+                    except ValueError:
+                        pass # Couldn't afford it, as far as this database knows
+            await gather(*[work(db, seed) for seed, db in enumerate([a, b] * 4)])
+            await gather(a.add_user_money(1, 500), b.add_bank_money(2, 300))
+            assert await a.flush() and await b.flush()
+
+            stored = store.data["users"]
+            total = sum(user.get("money", 0) + user.get("bank", 0) for user in stored.values())
+            assert total == users * 1000 + 800
+            for db in [a, b]: # Each has only seen its own writes
+                await db.update_cache()
+                assert db.cache["users"] == stored
+                await db.close()
+    run(main())
+
+
+def test_reconcile_keeps_writes_flushed_during_download():
+    async def main():
+        async with FakeStore({"guilds": {"5": {"prefix": "old"}}}) as store:
+            db = await connect(store)
+            store.set(["guilds", "6", "prefix"], "?") # So there's something new to download
+            store.record(["guilds", "6", "prefix"])
+
+            # The download reads the old prefix, but is still going when the new one is flushed
+            stream, finish = db.backend.stream, Event()
+            async def slow_stream(callback, **kwargs):
+                result = await stream(callback, **kwargs)
+                await finish.wait()
+                return result
+            db.backend.stream = slow_stream
+            reconcile = ensure_future(db.update_cache())
+            await sleep(0.05)
+            await db.set_guild_prefix(5, "new")
+            assert await db.flush()
+            finish.set()
+            await reconcile
+
+            assert store.data["guilds"]["5"]["prefix"] == "new"
+            assert db.guild_prefix(5) == "new" and db.guild_prefix(6) == "?"
+            await db.close()
+    run(main())
+
+
+def test_transfer_is_rejected_if_the_store_has_less():
+    async def main():
+        async with FakeStore({"users": {"1": {"money": 40}, "3": {"money": 5}}}) as store:
+            db = await connect(store)
+            store.set(["users", "1", "money"], 10) # Spent somewhere this database hasn't seen
+
+            assert await db.transfer_user_money(1, 3, 30) == [10, 35]
+            await db.add_user_money(3, 1)
+            assert await db.flush()
+            assert store.data["users"] == {"1": {"money": 10}, "3": {"money": 6}}
+            assert (db.user_money(1), db.user_money(3)) == (40, 6) # Undone, until the next reconcile
+            await db.close()
+    run(main())
+
+
+def test_rejected_write_doesnt_hold_up_the_rest():
+    async def main():
+        async with FakeStore({"users": {"1": {"money": 5}}}) as store:
+            db = await connect(store)
+            store.set(["users", "2", "money"], "lots") # Can't be added to
+            db.MAX_PENDING = 3
+
+            await db.set_guild_prefix(5, "?")
+            await db.add_user_money(2, 5)
+            await db.add_user_money(1, 5)
+            await db.transfer_user_money(1, 3, 2)
+            await db.set_guild_prefix(6, "!") # Waits for room, which there is once the bad write is dropped
+            assert await db.flush() and not db.pending
+            assert store.data == {
+                "users": {"1": {"money": 8}, "2": {"money": "lots"}, "3": {"money": 2}},
+                "guilds": {"5": {"prefix": "?"}, "6": {"prefix": "!"}},
+            }
+            await db.close()
+    run(main())
+
+
+def test_writes_replaced_in_the_same_batch_stay_replaced():
+    async def main():
+        async with FakeStore({"users": {"1": {"money": 50}, "2": {"money": 50}}}) as store:
+            db = await connect(store)
+            await db.transfer_user_money(1, 2, 5)
+            await db.delete_user(2)
+            await db.transfer_user_money(1, 3, 5)
+            await db.save("users/3", {"money": 1})
+            assert await db.flush()
+            assert store.data["users"] == {"1": {"money": 40}, "3": {"money": 1}}
+            assert db.cache["users"] == store.data["users"]
+            await db.close()
+    run(main())
+
+
+class PostOnlyStore(FakeStore):
+    """A store that only takes `POST` and `DELETE` writes, without batches or increments"""
+    async def handle(self, request):
+        if request.method == "PATCH":
+            raise web.HTTPMethodNotAllowed(request.method, ["GET", "POST", "DELETE"])
+        return await super().handle(request)
+
+
+def test_writes_are_sent_one_at_a_time_without_batches():
+    async def main():
+        async with PostOnlyStore({"users": {"1": {"money": 5}}, "guilds": {"6": {"prefix": "?"}}}) as store:
+            db = await connect(store)
+            await db.set_guild_prefix(5, "new")
+            await db.add_user_money(1, 100)
+            await db.transfer_user_money(1, 2, 5)
+            await db.delete_guild(6)
+            assert await db.flush()
+            assert store.data == {"users": {"1": {"money": 100}, "2": {"money": 5}}, "guilds": {"5": {"prefix": "new"}}}
+
+            await db.add_user_money(2, 1) # Straight to one at a time
+            assert await db.flush() and store.data["users"]["2"] == {"money": 6}
+            await db.close()
+    run(main())
+
+
+def test_sqlite_transfer_is_all_or_nothing(tmp_path):
+    async def main():
+        backend = SQLiteBackend(str(tmp_path / "bot.db"))
+        await backend.set("users/1/money", 10)
+        with pytest.raises(WriteRejected):
+            await backend.batch([("users/3/money", "transfer", 30, 0), ("users/1/money", "transfer", -30, 0)])
+        assert await backend.fetch() == {"users": {"1": {"money": 10}}}
+        await backend.close()
+    run(main())
+
+
+def test_sqlite_stores_what_the_rest_store_does(tmp_path):
+    writes = [
+        ("users/1/money", 5), ("foo/bar", 3), ("guilds/2", {"prefix": "?", "colour": "red"}),
+        ("users/abc", {"money": 1}), ("users/4", {"money": 2, "bank": 3, "items": ["pick"]}),
+        ("blacklist/guilds/8", "spam"), ("blacklist/guilds/9", "eggs"), ("blacklist/guilds/9/why", "x"),
+        ("foo", {"baz": [1, 2]}), ("users/1/money/x", 2), ("guilds/2/colour", None),
+        ("users/4/bank", None), ("other", 1.5),
+    ]
+    async def main():
+        store, backend = FakeStore(), SQLiteBackend(str(tmp_path / "bot.db"))
+        for key, value in writes:
+            store.set(key.split("/"), value)
+            await backend.set(key, value)
+            assert await backend.fetch() == store.data, key
+        increments = [("foo/count", "inc", 2, None), ("users/4/money", "inc", -5, 0)]
+        store.batch([dict(key=key, op=op, value=value, minimum=minimum) for key, op, value, minimum in increments])
+        await backend.batch(increments)
+        assert await backend.fetch() == store.data
+        await backend.close()
+    run(main())
+
+
+def test_sqlite_database_keeps_every_write(tmp_path):
+    url = f"sqlite://{tmp_path / 'bot.db'}"
+    async def main():
+        db = await Database.create(url)
+        await db.save("foo/bar", 3)
+        await db.save("other", 1.5)
+        await db.set_guild_prefix(5, "?")
+        await db.add_user_money(1, 10)
+        assert await db.flush()
+        await db.close()
+
+        db = await Database.create(url)
+        assert db.cache == {
+            "foo": {"bar": 3}, "other": 1.5, "guilds": {"5": {"prefix": "?"}}, "users": {"1": {"money": 10}},
+        }
+        await db.close()
+    run(main())
+
+
+def test_snapshot_waits_for_pending_writes(tmp_path):
+    snapshot = tmp_path / "bot.snapshot"
+    async def main():
+        async with FakeStore({"users": {"1": {"money": 5}}}) as store:
+            db = await Database.create(store.url, snapshot=str(snapshot))
+            snapshot.unlink()
+            db.FLUSH_DELAY = 60 # So the write is still waiting
+            await db.add_user_money(1, 3)
+            await db.save_snapshot()
+            assert not snapshot.exists()
+
+            assert await db.flush()
+            assert snapshot.exists() # Saved now there's nothing waiting
+            await db.close()
+
+            db = Database(store.url, snapshot=str(snapshot))
+            assert db.ready and db.user_money(1) == 8
+            await db.close()
+    run(main())
+
+
+class PlainStore(FakeStore):
+    """A store that ignores `?events`, sending the whole database like any other download"""
+    async def stream_events(self, request):
+        return web.json_response(dict(result=self.data, revision=self.revision, ok=True))
+
+
+class ClosingBackend(object):
+    """Downloads one user, and closes every event stream straight away"""
+    def __init__(self, revision=1):
+        self.revision, self.downloads, self.streams = revision, 0, 0
+
+    async def stream(self, callback, **kwargs):
+        self.downloads += 1
+        callback((), {"users": {"1": {"money": 5}}})
+
+    async def listen(self, callback):
+        self.streams += 1
+        return True
+
+    async def close(self):
+        pass
+
+
+def test_listen_stops_if_the_store_doesnt_send_events():
+    async def main():
+        async with PlainStore({"users": {"1": {"money": 5}}}) as store:
+            db = await connect(store)
+            requests = store.requests
+            await wait_for(db.listen(), 2)
+            assert not db.listening and store.requests == requests + 1
+            await db.close()
+    run(main())
+
+
+def test_listen_stops_without_a_revision():
+    async def main():
+        backend = ClosingBackend(revision=None)
+        db = Database(backend=backend)
+        await wait_for(db.listen(), 2)
+        assert backend.downloads == 1 and backend.streams == 0
+        assert db.user_money(1) == 5
+        await db.close()
+    run(main())
+
+
+def test_listen_backs_off_when_streams_keep_closing():
+    async def main():
+        backend = ClosingBackend()
+        db = Database(backend=backend)
+        db.LISTEN_RETRY = 0.05
+        db.listen()
+        await sleep(0.5) # Waits of 0.05, 0.1, 0.2...
+        assert 2 <= backend.streams <= 4 and backend.downloads == 1
+        await db.close()
+    run(main())
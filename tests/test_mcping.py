@@ -0,0 +1,102 @@
+from asyncio import run
+
+import pytest
+
+from benchmarks.fakemc import FakeBedrockServer, FakeLegacyServer, FakeMinecraftServer
+from cogs.assets import mcping
+from cogs.assets.mcping import PingError, ping
+
+
+@pytest.fixture(autouse=True)
+def forget_protocols():
+    mcping.protocols.clear()
+    yield
+    mcping.protocols.clear()
+
+
+async def ping_fake(server, **kwargs):
+    async with server:
+        return await ping(server.address, timeout=2, **kwargs), server.pings
+
+
+def test_java():
+    status, pings = run(ping_fake(FakeMinecraftServer(legacy=False), edition="java"))
+    assert pings == 1
+    assert (status.edition, status.version, status.protocol) == ("java", "1.15.2", 578)
+    assert (status.online, status.max, status.sample) == (5, 100, ["Notch"])
+    assert status.description == "A Minecraft Server for testing"
+
+
+def test_java_without_pong():
+    status, _ = run(ping_fake(FakeMinecraftServer(pong=False, legacy=False), edition="java"))
+    assert status.edition == "java" and status.online == 5
+
+
+def test_java_short_pong():
+    status, _ = run(ping_fake(FakeMinecraftServer(pong=4, legacy=False), edition="java"))
+    assert status.edition == "java" and status.online == 5
+
+
+@pytest.mark.parametrize("status", [
+    {"players": 5, "version": "1.15.2", "description": {"text": "Hi", "extra": 3}},
+    {"players": {"online": "5", "sample": [1, {"name": 2}, {"name": "Notch"}]}, "version": {"protocol": None}, "favicon": 1},
+])
+def test_java_status_of_the_wrong_types(status):
+    status, _ = run(ping_fake(FakeMinecraftServer(status, legacy=False), edition="java"))
+    assert (status.online, status.max, status.protocol, status.favicon) == (0, 0, 0, None)
+    assert status.sample in ([], ["", "Notch"])
+
+
+def test_legacy():
+    status, pings = run(ping_fake(FakeLegacyServer()))
+    assert pings == 1
+    assert (status.edition, status.version, status.protocol) == ("legacy", "1.6.4", 78)
+    assert (status.online, status.max, status.description) == (3, 20, "A Legacy Server")
+
+
+def test_legacy_beta():
+    status, _ = run(ping_fake(FakeLegacyServer(beta=True)))
+    assert status.edition == "legacy" and (status.online, status.max) == (3, 20)
+    assert status.description == "A Legacy Server"
+
+
+def test_bedrock():
+    status, pings = run(ping_fake(FakeBedrockServer()))
+    assert pings == 1
+    assert (status.edition, status.version, status.protocol) == ("bedrock", "1.14.60", 390)
+    assert (status.online, status.max, status.description) == (7, 30, "A Bedrock Server\nBedrock level")
+
+
+def test_bedrock_resends_lost_pings(monkeypatch):
+    monkeypatch.setattr(mcping, "BEDROCK_RESEND", 0.05)
+    status, pings = run(ping_fake(FakeBedrockServer(drop=2), edition="bedrock"))
+    assert status.edition == "bedrock" and pings == 1
+
+
+def test_race_waits_for_java():
+    """A Java server answers legacy pings sooner, since they're a single round trip,
+    but it's still reported as Java if that answers within the grace period"""
+    status, pings = run(ping_fake(FakeMinecraftServer(delay=0.05)))
+    assert status.edition == "java" and status.version == "1.15.2"
+    assert pings == 2 # One legacy, one Java
+    assert mcping.protocols[mcping.normalize_address(status.address)] == "java"
+
+
+def test_race_grace_runs_out(monkeypatch):
+    monkeypatch.setattr(mcping, "LEGACY_GRACE", 0.05)
+    status, _ = run(ping_fake(FakeMinecraftServer(delay=0.2)))
+    assert status.edition == "legacy" and status.description == "A Minecraft Server"
+
+
+def test_remembers_protocol():
+    async def twice():
+        async with FakeLegacyServer() as server:
+            await ping(server.address, timeout=2)
+            await ping(server.address, timeout=2)
+            return server.pings
+    assert run(twice()) == 2 # No racing the second time
+
+
+def test_nothing_answers():
+    with pytest.raises(PingError):
+        run(ping("127.0.0.1:1", timeout=1))
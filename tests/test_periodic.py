@@ -0,0 +1,166 @@
+from asyncio import gather, run, sleep
+from time import monotonic
+from types import SimpleNamespace
+
+from cogs.assets import periodic
+from cogs.assets.periodic import PingExecutor, PingScheduler, ServerStatus, TokenBucket
+
+
+async def scheduled(schedule, wait: float, *, delay=None, workers: int=1) -> list:
+    """The keys pinged within `wait` seconds, in order, after `schedule(scheduler)`.
+    Each ping returns `delay` as the time until the next"""
+    pinged = list()
+    async def ping(key):
+        pinged.append(key)
+        return delay
+    scheduler = PingScheduler(ping, workers=workers, jitter=0)
+    scheduler.start()
+    try:
+        schedule(scheduler)
+        await sleep(wait)
+    finally:
+        scheduler.stop()
+    return pinged
+
+
+def test_scheduler_pings_in_due_order():
+    def schedule(scheduler):
+        for key, delay in [("a", 0.06), ("b", 0.02), ("c", 0.04)]:
+            scheduler.schedule(key, delay)
+    assert run(scheduled(schedule, 0.1)) == ["b", "c", "a"]
+
+
+def test_scheduler_repeats_until_told_to_stop():
+    pinged = run(scheduled(lambda scheduler: scheduler.schedule("a", 0), 0.25, delay=0.1))
+    assert pinged == ["a"] * 3 # At 0, 0.1 and 0.2
+
+
+def test_scheduler_cancel_and_reschedule():
+    def schedule(scheduler):
+        scheduler.schedule("gone", 0.02)
+        scheduler.schedule("later", 10)
+        scheduler.schedule("sooner", 10)
+        scheduler.cancel("gone")
+        scheduler.schedule("sooner", 0.01) # Moved up, so the old due time is ignored
+        assert "gone" not in scheduler and len(scheduler) == 2
+    assert run(scheduled(schedule, 0.05)) == ["sooner"]
+
+
+class FakeExecutor(object):
+    def __init__(self):
+        self.pinged = list()
+
+    async def ping(self, address: str):
+        self.pinged.append(address)
+        return SimpleNamespace(online=3, max=20, latency=12)
+
+
+def server_status(*guildids: int) -> ServerStatus:
+    """The cog, with a fake executor, for a bot in guilds that record their nicknames"""
+    nicks = dict()
+    def guild(guildid: int):
+        async def edit(nick):
+            nicks[guildid] = nick
+        return SimpleNamespace(id=guildid, me=SimpleNamespace(edit=edit))
+    guilds = {guildid: guild(guildid) for guildid in guildids}
+    cog = ServerStatus(SimpleNamespace(db=None, get_guild=guilds.get))
+    cog.executor, cog.nicks = FakeExecutor(), nicks
+    return cog
+
+
+def test_guilds_on_one_server_share_a_ping():
+    async def main():
+        cog = server_status(1, 2, 3)
+        cog.scheduler.start()
+        try:
+            cog.create_task(1, "mc.example.com")
+            cog.create_task(2, "MC.example.com:25565")
+            cog.create_task(3, "other.example.com")
+            await sleep(0.05)
+            assert sorted(cog.executor.pinged) == ["mc.example.com", "other.example.com"]
+            assert cog.nicks == {guildid: "3/20 plyrs - 10ms ping" for guildid in [1, 2, 3]}
+
+            cog.stop_task(1) # Guild 2 is still using it
+            assert "mc.example.com" in cog.scheduler
+            cog.stop_task(2)
+            assert "mc.example.com" not in cog.scheduler and len(cog.tasks) == 1
+        finally:
+            cog.scheduler.stop()
+    run(main())
+
+
+def test_token_bucket_lets_a_burst_through_then_the_rate():
+    async def main():
+        bucket, start, times = TokenBucket(rate=20, burst=2), monotonic(), list()
+        async def take():
+            await bucket.take()
+            times.append(monotonic() - start)
+        await gather(*[take() for _ in range(4)])
+        return times
+    times = run(main())
+    assert times[1] < 0.02 # The burst
+    assert 0.04 < times[2] < 0.08 and 0.09 < times[3] < 0.13 # Then one every 0.05s
+
+
+def run_all(*coros):
+    async def main():
+        return await gather(*coros)
+    return run(main())
+
+
+def fake_pings(monkeypatch, duration: float=0) -> list:
+    """Replaces pinging with something that takes `duration` seconds, returning
+    `(address, start, end)` for each ping as it's sent"""
+    pings = list()
+    async def ping(address, **kwargs):
+        sent = [address, monotonic(), None]
+        pings.append(sent)
+        await sleep(duration)
+        sent[2] = monotonic()
+        return SimpleNamespace(online=1)
+    monkeypatch.setattr(periodic, "ping", ping)
+    return pings
+
+
+def most_at_once(pings: list) -> int:
+    """The most pings that were running at the same time, counting unfinished ones as still running"""
+    return max(sum(1 for _, start, end in pings if start <= at and (end is None or at < end)) for _, at, _ in pings)
+
+
+def test_executor_rate_limits_each_host(monkeypatch):
+    pings = fake_pings(monkeypatch)
+    executor = PingExecutor(rate=10, burst=1, concurrency=8, ramp=0)
+    addresses = ["a.example.com", "a.example.com:25566", "a.example.com", "b.example.com"]
+    run_all(*map(executor.ping, addresses))
+
+    start = min(at for _, at, _ in pings)
+    sent = {(address, round((at - start) * 10)) for address, at, _ in pings} # In tenths of a second
+    assert sent == {("a.example.com", 0), ("a.example.com:25566", 1), ("a.example.com", 2), ("b.example.com", 0)}
+
+
+def test_executor_caps_pings_at_once(monkeypatch):
+    pings = fake_pings(monkeypatch, 0.05)
+    executor = PingExecutor(rate=100, burst=100, concurrency=3, ramp=0)
+    run_all(*[executor.ping(f"{i}.example.com") for i in range(9)])
+    assert len(pings) == 9 and most_at_once(pings) == 3
+    assert executor.gauges["inflight"] == executor.gauges["queued"] == 0
+
+
+def test_executor_ramps_up(monkeypatch):
+    pings = fake_pings(monkeypatch, 0.05)
+    async def main():
+        executor = PingExecutor(rate=100, burst=100, concurrency=4, ramp=0.6) # One more every 0.2s
+        executor.start()
+        try:
+            first = gather(*[executor.ping(f"{i}.example.com") for i in range(3)])
+            await sleep(0.03) # Only one at a time to start with
+            assert executor.gauges["inflight"] == 1 and executor.gauges["queued"] == 2
+            await first
+            assert most_at_once(pings) == 1
+            await sleep(0.55)
+            assert executor.capacity == 4
+            await gather(*[executor.ping(f"{i}.example.com") for i in range(3, 11)])
+            assert most_at_once(pings[3:]) == 4
+        finally:
+            executor.stop()
+    run(main())
@@ -207,12 +207,14 @@ async def guildsettings_backend(request: web.Request):
     prefix = data.get("prefix")
     serverip = data.get("serverip")
     minecraftrole = data.get("minecraftrole")
+    changes = dict()
     if prefix != oldprefix and prefix != None:
-        await db.set_guild_prefix(guild.id, prefix)
+        changes["prefix"] = prefix
     if serverip != oldserverip and serverip != None:
-        await db.set_minecraft_server(guild.id, serverip)
+        changes["minecraft"] = serverip
     if minecraftrole != str(oldminecraftrole) and minecraftrole != None:
-        await db.set_minecraft_role(guild.id, minecraftrole or None)
+        changes["role"] = minecraftrole
+    await db.update_guild(guild.id, **changes) # All in one write
     return web.HTTPFound(f"/guildsettings/{guildid}?saved")
 
 @routes.get("/support")